@@ -0,0 +1,8 @@
+"""
+Benchmarks for ingest, analysis and catalog browsing.
+
+Run everything against synthetic data in a temporary directory:
+    python -m benchmarks.run --output results.json
+Compare two runs:
+    python -m benchmarks.compare baseline.json results.json
+"""
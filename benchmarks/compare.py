@@ -0,0 +1,81 @@
+"""
+Compares two benchmark result files and flags regressions.
+
+Latencies, sizes and durations (keys ending in _ms, _s, _mb or _bytes*) are
+better when lower; throughputs (keys containing _per_s) are better when
+higher. Usage:
+    python -m benchmarks.compare baseline.json results.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# Keys that describe the run rather than measure it
+_INFORMATIONAL = ("count", "images", "rows", "concurrency", "mock_latency_s", "rate_limit_ratio",
+                  "input_mb", "original_mb", "mock_requests", "mock_rate_limited", "succeeded", "failed")
+
+
+def flatten(results, prefix=""):
+    """Returns {dotted.key: number} for every numeric leaf."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def direction(key):
+    """+1 if higher is better, -1 if lower is better, 0 if the key isn't a measurement."""
+    name = key.rsplit(".", 1)[-1]
+    if name in _INFORMATIONAL:
+        return 0
+    if "_per_s" in name:
+        return 1
+    if name.endswith(("_ms", "_s", "_mb", "_ratio")) or "_bytes" in name:
+        return -1
+    return 0
+
+
+def compare(baseline, current, threshold):
+    """Returns rows of (key, old, new, change_percent, regressed)."""
+    old, new = flatten(baseline["results"]), flatten(current["results"])
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        better = direction(key)
+        if not better or not old[key]:
+            continue
+        change = (new[key] - old[key]) / old[key] * 100
+        rows.append((key, old[key], new[key], change, change * better < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change treated as a regression")
+    parser.add_argument("--all", action="store_true", help="Show unchanged metrics too")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    print(f"{'metric':<58} {'baseline':>12} {'current':>12} {'change':>9}")
+    for key, old, new, change, regressed in rows:
+        if args.all or abs(change) >= args.threshold:
+            marker = "  REGRESSION" if regressed else ""
+            print(f"{key:<58} {old:12.3f} {new:12.3f} {change:+8.1f}%{marker}")
+
+    regressions = sum(1 for row in rows if row[4])
+    print(f"\n{len(rows)} metrics compared, {regressions} regressed by more than {args.threshold:.0f}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Local mock of the OpenAI chat-completions and Batch API endpoints.
+
+Returns a canned catalog analysis after a configurable delay, and can answer
+a share of requests with HTTP 429 to exercise rate-limit handling. Batches
+(file upload, batch create/retrieve, file content) complete batch_delay
+seconds after they are created, with one canned analysis per request. Used
+by the benchmarks, and handy for trying the dashboard without an API key:
+    python -m benchmarks.mock_openai --port 8099 --latency 1.5
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 streamlit run dashboard.py
+"""
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Rough prompt token counts: system prompt text plus the image at each detail level
+TEXT_PROMPT_TOKENS = 700
+IMAGE_TOKENS = {"low": 85, "high": 765}
+COMPLETION_TOKENS = 450
+
+_STYLES = ("Soft Minimalism", "Neon Noir", "Organic Brutalism", "Pastel Futurism", "Editorial Documentary")
+_TAGS = ("calm", "bold", "serene", "energetic", "moody", "playful", "nostalgic", "clean", "warm", "dramatic")
+_USE_CASES = ("Website hero", "Social media", "Poster", "Presentation background", "Packaging", "Blog header")
+
+
+def canned_analysis(number, rng=random):
+    """A plausible analysis result, as the model would return it."""
+    colors = ", ".join(f"#{rng.randrange(0x1000000):06X}" for _ in range(4))
+    return {
+        "image_id": f"AI-MOCK-{number:06d}",
+        "image_type": rng.choice(("AI-Generated", "Real Photograph")),
+        "style_name": rng.choice(_STYLES),
+        "composition_structure": "Centered subject with negative space on the left third.",
+        "color_palette": f"Primary and accent colours: {colors}",
+        "lighting": "Soft, diffuse daylight from the upper left.",
+        "texture_finish": "Matte with subtle grain.",
+        "geometry_flow": "Gentle diagonal leading lines.",
+        "primary_emotional_tone": rng.choice(_TAGS).title(),
+        "emotional_keyword_tags": ", ".join(rng.sample(_TAGS, 4)),
+        "narrative_metaphor": "A quiet pause before something begins.",
+        "ai_generation_prompt": "minimal scene, soft light, muted palette, 35mm, shallow depth of field",
+        "recreation_guidelines": "Shoot at golden hour; keep the palette restrained.",
+        "recommended_use_cases": ", ".join(rng.sample(_USE_CASES, 2)),
+    }
+
+
+def _multipart_fields(content_type, body):
+    """Returns {field name: (filename, bytes)} for a multipart/form-data body."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"content-type: {content_type}\r\n\r\n".encode() + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+        for part in message.iter_parts()
+    }
+
+
+class MockOpenAIServer:
+    """Threaded HTTP server answering chat-completions and Batch API requests."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, rate_limit_ratio=0.0, seed=None, batch_delay=0.0):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.batch_delay = batch_delay
+        self.requests = 0
+        self.rate_limited = 0
+        # Uploaded and generated files ({id: (metadata, bytes)}) and batches ({id: batch})
+        self.files = {}
+        self.batches = {}
+        self._batch_lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Serves in a background thread. Returns the base URL."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        """Serves on the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _next_response(self, request, rate_limit=True):
+        """Returns (status, headers, body) for one chat-completions request."""
+        with self._lock:
+            self.requests += 1
+            if rate_limit and self._rng.random() < self.rate_limit_ratio:
+                self.rate_limited += 1
+                body = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+                return 429, {"retry-after": "0.1"}, body
+            number = next(self._ids)
+            content = json.dumps(canned_analysis(number, self._rng))
+
+        detail = "high"
+        for message in request.get("messages", []):
+            if isinstance(message.get("content"), list):
+                for part in message["content"]:
+                    if part.get("type") == "image_url":
+                        detail = part["image_url"].get("detail", "high")
+        prompt_tokens = TEXT_PROMPT_TOKENS + IMAGE_TOKENS.get(detail, IMAGE_TOKENS["high"])
+        body = {
+            "id": f"chatcmpl-mock-{number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": COMPLETION_TOKENS,
+                "total_tokens": prompt_tokens + COMPLETION_TOKENS,
+            },
+        }
+        return 200, {}, body
+
+    # --- Batch API ---
+
+    def _add_file(self, content, filename, purpose):
+        with self._lock:
+            file_id = f"file-mock-{len(self.files) + 1}"
+            metadata = {
+                "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed",
+            }
+            self.files[file_id] = (metadata, content)
+        return metadata
+
+    def _create_batch(self, request):
+        input_file = self.files.get(request.get("input_file_id"))
+        if input_file is None:
+            return 404, {}, {"error": {"message": f"No such file: {request.get('input_file_id')}"}}
+        lines = [line for line in input_file[1].decode().splitlines() if line.strip()]
+        with self._lock:
+            batch_id = f"batch_mock_{len(self.batches) + 1}"
+            batch = self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request.get("endpoint"), "errors": None,
+                "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window"),
+                "status": "in_progress", "output_file_id": None, "error_file_id": None,
+                "created_at": int(time.time()), "in_progress_at": int(time.time()), "completed_at": None,
+                "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+                "metadata": request.get("metadata"),
+            }
+            batch["_due"] = time.monotonic() + self.batch_delay
+            batch["_lines"] = lines
+        return 200, {}, self._public_batch(batch)
+
+    def _complete_batch(self, batch):
+        """Runs a due batch's requests and writes its output file."""
+        output = []
+        for line in batch.pop("_lines"):
+            request = json.loads(line)
+            status, _, body = self._next_response(request["body"], rate_limit=False)
+            output.append(json.dumps({
+                "id": f"batch_req_{len(output) + 1}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": status, "request_id": f"req_{len(output) + 1}", "body": body},
+                "error": None,
+            }))
+        output_file = self._add_file(("\n".join(output) + "\n").encode(), f"{batch['id']}_output.jsonl", "batch_output")
+        batch.update(
+            status="completed", output_file_id=output_file["id"], completed_at=int(time.time()),
+            request_counts={"total": len(output), "completed": len(output), "failed": 0},
+        )
+
+    def _retrieve_batch(self, batch_id):
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return 404, {}, {"error": {"message": f"No such batch: {batch_id}"}}
+        with self._batch_lock:
+            if batch["status"] == "in_progress" and time.monotonic() >= batch["_due"]:
+                self._complete_batch(batch)
+            return 200, {}, self._public_batch(batch)
+
+    @staticmethod
+    def _public_batch(batch):
+        return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, headers, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _not_found(self):
+                self._send_json(404, {}, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                raw = self.rfile.read(length)
+                if self.path.endswith("/files"):
+                    fields = _multipart_fields(self.headers.get("content-type", ""), raw)
+                    filename, content = fields["file"]
+                    purpose = fields.get("purpose", (None, b""))[1].decode()
+                    self._send_json(200, {}, server._add_file(content, filename, purpose))
+                elif self.path.endswith("/batches"):
+                    self._send_json(*server._create_batch(json.loads(raw or b"{}")))
+                elif self.path.endswith("/chat/completions"):
+                    if server.latency:
+                        time.sleep(server.latency)
+                    self._send_json(*server._next_response(json.loads(raw or b"{}")))
+                else:
+                    self._not_found()
+
+            def do_GET(self):
+                batch_match = re.search(r"/batches/([^/?]+)$", self.path)
+                content_match = re.search(r"/files/([^/?]+)/content$", self.path)
+                if batch_match:
+                    self._send_json(*server._retrieve_batch(batch_match.group(1)))
+                elif content_match and content_match.group(1) in server.files:
+                    content = server.files[content_match.group(1)][1]
+                    self.send_response(200)
+                    self.send_header("content-type", "application/octet-stream")
+                    self.send_header("content-length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                else:
+                    self._not_found()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI chat-completions and Batch APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Seconds until a created batch completes")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.host, args.port, args.latency, args.rate_limit_ratio, batch_delay=args.batch_delay)
+    print(f"Mock OpenAI API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Runs the benchmark suites and writes the results as JSON.
+
+Suites:
+    ingest    saving originals and creating thumbnail renditions
+    encode    preparing images for the API (time, bytes sent, peak memory)
+    catalog   inserting and querying synthetic catalogs of each --rows size
+    analysis  end-to-end batch and async analysis against the mock API
+
+Everything runs in a temporary working directory; the real catalog is never
+touched. Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --suites catalog --rows 1000 10000 100000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import synthetic
+from benchmarks.mock_openai import MockOpenAIServer
+from src import batch_analyzer, db_manager, file_manager, metrics, vision_analyzer
+
+SUITES = ("ingest", "encode", "catalog", "analysis")
+DEFAULT_ROWS = (1000, 10000)
+DEFAULT_IMAGES = 24
+DEFAULT_QUERY_RUNS = 50
+INSERT_BATCH_SIZE = 500
+SEARCH_TERMS = ("calm", "soft light", "neon", "organic texture", "poster")
+
+
+def percentiles(samples):
+    """Summary of latency samples (seconds) in milliseconds."""
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": at(0.50),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(func, *args, **kwargs):
+    """Returns (result, elapsed seconds)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def use_workdir(workdir):
+    """Points the database and file storage at a scratch directory."""
+    db_manager.close_connection()
+    db_manager.DB_PATH = os.path.join(workdir, "catalog.db")
+    file_manager.UPLOAD_DIR = os.path.join(workdir, "uploads")
+    file_manager.THUMBNAIL_DIR = os.path.join(workdir, "thumbnails")
+    db_manager.create_table()
+
+
+# --- Suites ---
+
+def bench_ingest(corpus, workdir):
+    use_workdir(workdir)
+    saves = []
+    for path in corpus:
+        _, elapsed = timed(file_manager.save_local_file, path)
+        saves.append(elapsed)
+    total_bytes = sum(os.path.getsize(path) for path in corpus)
+
+    # Renditions alone: drop them and recreate from the saved originals
+    shutil.rmtree(file_manager.THUMBNAIL_DIR)
+    originals = [os.path.join(file_manager.UPLOAD_DIR, name) for name in sorted(os.listdir(file_manager.UPLOAD_DIR))]
+    renditions = [timed(file_manager.create_renditions, path)[1] for path in originals]
+    return {
+        "images": len(corpus),
+        "input_mb": total_bytes / 1e6,
+        "save": percentiles(saves),
+        "save_images_per_s": len(saves) / sum(saves),
+        "save_mb_per_s": total_bytes / 1e6 / sum(saves),
+        "renditions": percentiles(renditions),
+        "renditions_images_per_s": len(renditions) / sum(renditions),
+    }
+
+
+def bench_encode(corpus):
+    durations, sent, original = [], 0, 0
+    for path in corpus:
+        (_, _, _, original_bytes, sent_bytes), elapsed = timed(vision_analyzer.encode_image_data_url, path)
+        durations.append(elapsed)
+        sent += sent_bytes
+        original += original_bytes
+
+    # Separate pass: tracemalloc slows allocation-heavy code down. It only sees
+    # Python allocations (buffers, the data URL), not Pillow's decode buffers.
+    peaks = []
+    for path in corpus:
+        tracemalloc.start()
+        vision_analyzer.encode_image_data_url(path)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        "images": len(corpus),
+        "encode": percentiles(durations),
+        "original_mb": original / 1e6,
+        "sent_mb": sent / 1e6,
+        "sent_ratio": sent / original if original else 0.0,
+        "python_peak_bytes_max": max(peaks),
+        "python_peak_bytes_mean": statistics.fmean(peaks),
+    }
+
+
+def _query_latencies(runs, make_call):
+    """Times make_call(i)() for i in range(runs), with the read cache cleared before each call."""
+    samples = []
+    for i in range(runs):
+        call = make_call(i)
+        db_manager.clear_read_cache()
+        _, elapsed = timed(call)
+        samples.append(elapsed)
+    return percentiles(samples)
+
+
+def bench_catalog(rows, workdir, query_runs):
+    use_workdir(workdir)
+    records = synthetic.make_catalog_records(rows, seed=rows)
+    inserts = []
+    for start in range(0, rows, INSERT_BATCH_SIZE):
+        _, elapsed = timed(db_manager.insert_image_records, records[start:start + INSERT_BATCH_SIZE])
+        inserts.append(elapsed)
+
+    ids = [record["image_id"] for record in records]
+    middle_cursor = ids[len(ids) // 2]
+    style = records[0]["style_name"]
+    queries = {
+        "first_page": lambda i: lambda: db_manager.get_images_page(),
+        "deep_page": lambda i: lambda: db_manager.get_images_page(after_id=middle_cursor),
+        "filtered_page": lambda i: lambda: db_manager.get_images_page(filters={"style_name": [style], "tag": ["calm"]}),
+        "count": lambda i: lambda: db_manager.count_images(),
+        "facet_counts": lambda i: lambda: db_manager.get_facet_counts(),
+        "details": lambda i: lambda: db_manager.get_image_details(ids[(i * 7919) % len(ids)]),
+        "search": lambda i: lambda: db_manager.search_images(SEARCH_TERMS[i % len(SEARCH_TERMS)]),
+        "search_count": lambda i: lambda: db_manager.count_search_results(SEARCH_TERMS[i % len(SEARCH_TERMS)]),
+    }
+    results = {
+        "rows": rows,
+        "insert_batch": percentiles(inserts),
+        "insert_rows_per_s": rows / sum(inserts),
+        "queries": {name: _query_latencies(query_runs, make_call) for name, make_call in queries.items()},
+    }
+
+    # Repeat reruns of the dashboard hit the read cache
+    db_manager.get_images_page()
+    cached = [timed(db_manager.get_images_page)[1] for _ in range(query_runs)]
+    results["queries"]["first_page_cached"] = percentiles(cached)
+    results["db_mb"] = os.path.getsize(db_manager.DB_PATH) / 1e6
+    return results
+
+
+def bench_analysis(corpus, workdir, concurrency, latency, rate_limit_ratio):
+    from src.async_analyzer import AsyncAnalyzer
+
+    import openai
+
+    results = {"concurrency": concurrency, "mock_latency_s": latency, "rate_limit_ratio": rate_limit_ratio}
+    with MockOpenAIServer(latency=latency, rate_limit_ratio=rate_limit_ratio, seed=0) as server:
+        # A client of our own, so the run doesn't depend on OPENAI_* settings;
+        # retries are left to batch_analyzer's backoff
+        vision_analyzer.client = openai.OpenAI(api_key="benchmark", base_url=server.base_url, max_retries=0)
+
+        use_workdir(workdir)
+        stats = batch_analyzer.run_batch(corpus, concurrency=concurrency)
+        results["batch"] = {
+            "images": stats.total,
+            "succeeded": stats.succeeded,
+            "failed": stats.failed,
+            "rate_limit_retries": stats.rate_limit_retries,
+            "elapsed_s": stats.elapsed,
+            "images_per_s": stats.throughput,
+        }
+
+        # Same images again: every one is answered from the analysis cache
+        stats = batch_analyzer.run_batch(corpus, concurrency=concurrency, skip_existing=False)
+        results["batch_cached"] = {"elapsed_s": stats.elapsed, "images_per_s": stats.throughput}
+
+        async def analyze_all():
+            async with AsyncAnalyzer(api_key="benchmark", base_url=server.base_url,
+                                     concurrency=concurrency, use_cache=False) as analyzer:
+                return await analyzer.analyze_many(corpus)
+
+        pairs, elapsed = timed(asyncio.run, analyze_all())
+        results["async"] = {
+            "images": len(pairs),
+            "succeeded": sum(1 for result, _ in pairs if result is not None),
+            "elapsed_s": elapsed,
+            "images_per_s": len(pairs) / elapsed,
+        }
+        results["mock_requests"] = server.requests
+        results["mock_rate_limited"] = server.rate_limited
+    vision_analyzer.client = None
+    return results
+
+
+# --- Runner ---
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(suites, rows, images, query_runs, concurrency, latency, rate_limit_ratio, workdir):
+    results = {}
+    corpus = []
+    if {"ingest", "encode", "analysis"} & set(suites):
+        corpus = synthetic.make_image_corpus(os.path.join(workdir, "corpus"), images)
+
+    if "ingest" in suites:
+        print("Running ingest suite...")
+        results["ingest"] = bench_ingest(corpus, os.path.join(workdir, "ingest"))
+    if "encode" in suites:
+        print("Running encode suite...")
+        results["encode"] = bench_encode(corpus)
+    if "catalog" in suites:
+        results["catalog"] = {}
+        for count in rows:
+            print(f"Running catalog suite with {count} rows...")
+            results["catalog"][str(count)] = bench_catalog(count, os.path.join(workdir, f"catalog-{count}"), query_runs)
+    if "analysis" in suites:
+        print("Running analysis suite...")
+        results["analysis"] = bench_analysis(
+            corpus, os.path.join(workdir, "analysis"), concurrency, latency, rate_limit_ratio
+        )
+    results["stages"] = stage_latencies()
+    db_manager.close_connection()
+    return results
+
+
+def stage_latencies():
+    """Per-stage latency recorded by src.metrics spans during the run."""
+    stages = {}
+    for histogram in metrics.snapshot()["histograms"]:
+        if histogram["name"] == metrics.STAGE_DURATION and histogram["count"]:
+            stages[histogram["labels"]["stage"]] = {
+                "count": histogram["count"],
+                "mean_ms": histogram["sum"] / histogram["count"] * 1000,
+                "p50_ms": metrics.quantile(histogram, 0.50) * 1000,
+                "p95_ms": metrics.quantile(histogram, 0.95) * 1000,
+            }
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, analysis and catalog browsing.")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--rows", nargs="+", type=int, default=list(DEFAULT_ROWS), help="Catalog sizes to test")
+    parser.add_argument("--images", type=int, default=DEFAULT_IMAGES, help="Synthetic images to generate")
+    parser.add_argument("--query-runs", type=int, default=DEFAULT_QUERY_RUNS, help="Samples per catalog query")
+    parser.add_argument("--concurrency", type=int, default=batch_analyzer.DEFAULT_CONCURRENCY)
+    parser.add_argument("--mock-latency", type=float, default=0.5, help="Seconds the mock API takes per request")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Share of mock requests answered with 429")
+    parser.add_argument("--workdir", help="Keep generated data here instead of a temporary directory")
+    parser.add_argument("--output", help="Write results to this JSON file (default: stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    started = time.perf_counter()
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        workdir, cleanup = args.workdir, None
+    else:
+        cleanup = tempfile.TemporaryDirectory(prefix="catalog-bench-")
+        workdir = cleanup.name
+    # Keep the run's metrics snapshots out of the real metrics directory
+    metrics.METRICS_DIR = os.path.join(workdir, "metrics")
+    try:
+        results = run(args.suites, args.rows, args.images, args.query_runs, args.concurrency,
+                      args.mock_latency, args.rate_limit_ratio, workdir)
+    finally:
+        metrics.flush()
+        if cleanup:
+            cleanup.cleanup()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "elapsed_s": time.perf_counter() - started,
+            # ru_maxrss is in KiB on Linux
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Deterministic synthetic data for the benchmarks: image files of realistic
+sizes and formats, and catalog rows with realistic text fields.
+"""
+import os
+import random
+
+import numpy as np
+from PIL import Image
+
+# (width, height, format) cycled through when generating images: phone
+# photos, screenshots, square social posts and small web images
+IMAGE_SPECS = (
+    (4032, 3024, "JPEG"),
+    (1920, 1080, "JPEG"),
+    (1080, 1080, "PNG"),
+    (2048, 1365, "JPEG"),
+    (800, 600, "JPEG"),
+    (1200, 1600, "PNG"),
+)
+
+_WORDS = (
+    "soft light muted palette geometric minimal organic texture grain warm cool "
+    "contrast shadow highlight gradient layered depth horizon urban coastal "
+    "forest abstract portrait product editorial vintage futuristic pastel neon"
+).split()
+_TAGS = ("calm", "bold", "serene", "energetic", "moody", "playful", "nostalgic", "clean", "warm", "dramatic",
+         "optimistic", "mysterious", "elegant", "raw", "dreamy")
+_STYLES = tuple(f"{a} {b}" for a in ("Soft", "Neon", "Organic", "Pastel", "Editorial", "Brutal")
+                for b in ("Minimalism", "Noir", "Futurism", "Documentary", "Pop"))
+_USE_CASES = ("Website hero", "Social media", "Poster", "Presentation background", "Packaging",
+              "Blog header", "Email banner", "Print ad")
+
+
+def make_image(width, height, seed):
+    """
+    A photo-like RGB image: smooth low-frequency colour fields plus fine
+    noise, so it compresses roughly like a real photograph.
+    """
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(6, 8, 3), dtype=np.uint8)
+    img = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(img, dtype=np.int16)
+    pixels += rng.integers(-12, 13, size=(height, width, 1), dtype=np.int16)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def make_image_corpus(directory, count, seed=0):
+    """Writes count images to directory, cycling through IMAGE_SPECS. Returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        width, height, image_format = IMAGE_SPECS[i % len(IMAGE_SPECS)]
+        extension = ".png" if image_format == "PNG" else ".jpg"
+        path = os.path.join(directory, f"synthetic-{seed}-{i:05d}{extension}")
+        if not os.path.exists(path):
+            make_image(width, height, seed * 100003 + i).save(path, image_format, quality=90)
+        paths.append(path)
+    return paths
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_catalog_records(count, seed=0):
+    """Returns count catalog rows (dicts keyed by db_manager.IMAGE_COLUMNS)."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        colors = ", ".join(f"#{rng.randrange(0x1000000):06X}" for _ in range(rng.randint(3, 6)))
+        records.append({
+            "image_id": f"BENCH-{i:07d}",
+            "image_path": f"/bench/uploads/{i:07d}.jpg",
+            "image_thumbnail": f"/bench/thumbnails/128/{i:07d}.webp",
+            "image_type": "AI-Generated" if rng.random() < 0.6 else "Real Photograph",
+            "style_name": rng.choice(_STYLES),
+            "composition_structure": _sentence(rng, 18),
+            "color_palette": f"Primary colours {colors} with neutral accents.",
+            "lighting": _sentence(rng, 10),
+            "texture_finish": _sentence(rng, 8),
+            "geometry_flow": _sentence(rng, 10),
+            "primary_emotional_tone": rng.choice(_TAGS).title(),
+            "emotional_keyword_tags": ", ".join(rng.sample(_TAGS, rng.randint(3, 6))),
+            "narrative_metaphor": _sentence(rng, 14),
+            "ai_generation_prompt": _sentence(rng, 30),
+            "recreation_guidelines": _sentence(rng, 25),
+            "recommended_use_cases": ", ".join(rng.sample(_USE_CASES, rng.randint(1, 3))),
+        })
+    return records
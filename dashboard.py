@@ -1,17 +1,35 @@
 import streamlit as st
-from src import db_manager, file_manager, vision_analyzer
+from src import batch_analyzer, db_manager, file_manager, image_features, vision_analyzer
 import json
 import os
+import time
 
 # --- Page Config ---
 st.set_page_config(page_title="Image Catalog", layout="wide")
 
+# Seconds between status checks while an analysis job is in flight
+JOB_POLL_SECONDS = 2
+
 # --- Initialize Database ---
-db_manager.create_table()
+# Creates/migrates the schema on the first run in this process; later reruns skip it
+db_manager.ensure_schema()
 
 # --- Session State ---
 if 'analysis_result' not in st.session_state:
     st.session_state.analysis_result = None
+# Saved paths per upload, so reruns don't rewrite the file or its thumbnail
+if 'saved_uploads' not in st.session_state:
+    st.session_state.saved_uploads = {}
+# Near-duplicate lookups per saved upload path
+if 'duplicate_checks' not in st.session_state:
+    st.session_state.duplicate_checks = {}
+# (image_path, image_thumbnail) of the image being reviewed
+if 'current_paths' not in st.session_state:
+    st.session_state.current_paths = None
+# Background analysis job being waited on; restored from the URL after a refresh
+if 'job_id' not in st.session_state:
+    job_param = st.query_params.get("job")
+    st.session_state.job_id = int(job_param) if job_param and job_param.isdigit() else None
 
 # --- UI ---
 st.title("🖼️ AI-Powered Image Catalog")
@@ -26,43 +44,43 @@ with col1:
 
     if uploaded_file:
         st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
+
+        # Warn before re-cataloging a picture that is already in the catalog.
+        # The check reads the upload in memory; nothing is written to disk
+        # until the user chooses AI analysis or manual input.
+        upload_key = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+        if upload_key not in st.session_state.duplicate_checks:
+            uploaded_file.seek(0)
+            st.session_state.duplicate_checks[upload_key] = db_manager.find_near_duplicates(uploaded_file)
+        for duplicate in st.session_state.duplicate_checks[upload_key]:
+            st.warning(f"⚠️ Looks like a near-duplicate of **{duplicate['image_id']}** ({duplicate['style_name']})")
         
         # Add buttons for AI analysis and manual input
         col1a, col1b = st.columns(2)
         
         with col1a:
             if st.button("🤖 Analyze with AI", use_container_width=True, type="primary"):
-                with st.spinner("AI is analyzing the image... This may take a moment."):
-                    try:
-                        # Save the file first
-                        file_path, _ = file_manager.save_uploaded_file(uploaded_file)
-                        st.success(f"✅ Image saved to: {file_path}")
-                        
-                        # Then analyze with AI
-                        st.info("🔄 Sending image to OpenAI for analysis...")
-                        result, debug_info = vision_analyzer.analyze_image_with_gpt(file_path)
-                        
-                        # Show debug information
-                        with st.expander("🔍 Debug Information", expanded=True):
-                            for info in debug_info:
-                                st.write(info)
-                        
-                        if result:
-                            st.session_state.analysis_result = result
-                            st.success("🎉 AI analysis completed!")
-                            with st.expander("📄 Raw AI Response"):
-                                st.json(result)
-                        else:
-                            st.error("❌ AI analysis failed. See debug information above for details.")
-                            st.info("💡 Try using Manual Input instead, or check your OpenAI API key and credits.")
-                    except Exception as e:
-                        st.error(f"❌ Error: {str(e)}")
+                try:
+                    # Save the file first
+                    file_path, thumb_path = file_manager.persist_upload(uploaded_file, st.session_state.saved_uploads)
+                    st.session_state.current_paths = (file_path, thumb_path)
+                    st.success(f"✅ Image saved to: {file_path}")
+
+                    # Then queue it for the background analysis worker
+                    job_id = db_manager.enqueue_analysis_job(file_path, thumb_path)
+                    st.session_state.job_id = job_id
+                    st.session_state.analysis_result = None
+                    # Keep the job in the URL so a browser refresh can pick it up again
+                    st.query_params["job"] = str(job_id)
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
         
         with col1b:
             if st.button("📝 Manual Input", use_container_width=True):
                 try:
                     # Save the file and setup manual input
-                    file_path, _ = file_manager.save_uploaded_file(uploaded_file)
+                    file_path, thumb_path = file_manager.persist_upload(uploaded_file, st.session_state.saved_uploads)
+                    st.session_state.current_paths = (file_path, thumb_path)
                     st.success(f"✅ Image saved to: {file_path}")
                     
                     # Create empty template for manual input
@@ -80,7 +98,8 @@ with col1:
                         'narrative_metaphor': '',
                         'ai_generation_prompt': 'N/A',
                         'recreation_guidelines': '',
-                        'recommended_use_cases': ''
+                        'recommended_use_cases': '',
+                        'prompt_version': db_manager.MANUAL_PROMPT_VERSION
                     }
                     st.info("📝 Manual input mode activated. Fill in the fields below.")
                 except Exception as e:
@@ -95,18 +114,50 @@ with col1:
                     try:
                         import json
                         parsed_data = json.loads(json_input)
+                        parsed_data.setdefault('prompt_version', db_manager.MANUAL_PROMPT_VERSION)
                         st.session_state.analysis_result = parsed_data
                         st.success("✅ Data loaded from JSON!")
                     except Exception as e:
                         st.error(f"❌ Invalid JSON: {str(e)}")
 
+    # --- Background Analysis Status ---
+    if st.session_state.job_id is not None:
+        job = db_manager.get_analysis_job(st.session_state.job_id)
+        if job is None:
+            st.session_state.job_id = None
+        elif job['status'] in ('queued', 'running'):
+            waited = time.time() - job['created_at']
+            st.info(f"⏳ AI analysis {job['status']} (attempt {max(job['attempts'], 1)} of {job['max_attempts']}, {waited:.0f}s so far). You can keep working; results appear here when ready.")
+            if job['error']:
+                st.caption(f"Last error: {job['error']}")
+        else:
+            # Show debug information
+            with st.expander("🔍 Debug Information", expanded=job['status'] == 'failed'):
+                for info in job['debug_info']:
+                    st.write(info)
+                cache_stats = vision_analyzer.get_cache_stats()
+                st.caption(f"Analysis cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+            if job['status'] == 'done':
+                st.session_state.analysis_result = job['result']
+                st.session_state.current_paths = (job['image_path'], job['image_thumbnail'])
+                st.success("🎉 AI analysis completed!")
+                with st.expander("📄 Raw AI Response"):
+                    st.json(job['result'])
+            else:
+                st.error(f"❌ AI analysis failed: {job['error']}")
+                st.info("💡 Try using Manual Input instead, or check your OpenAI API key and credits.")
+            st.session_state.job_id = None
+            st.query_params.clear()
+
 with col2:
     st.header("2. Review & Save Metadata")
     if uploaded_file and st.session_state.analysis_result:
+        # Add file paths to the data before saving (memoized per upload)
+        st.session_state.current_paths = file_manager.persist_upload(uploaded_file, st.session_state.saved_uploads)
+    if st.session_state.analysis_result and st.session_state.current_paths:
         data = st.session_state.analysis_result
         
-        # Add file paths to the data before saving
-        file_path, thumb_path = file_manager.save_uploaded_file(uploaded_file)
+        file_path, thumb_path = st.session_state.current_paths
         data['image_path'] = file_path
         data['image_thumbnail'] = thumb_path
         
@@ -146,44 +197,206 @@ with col2:
                     'narrative_metaphor': data.get('narrative_metaphor'),
                     'ai_generation_prompt': data.get('ai_generation_prompt'),
                     'recreation_guidelines': data.get('recreation_guidelines'),
-                    'recommended_use_cases': data.get('recommended_use_cases')
+                    'recommended_use_cases': data.get('recommended_use_cases'),
+                    'prompt_version': data.get('prompt_version')
                 }
                 db_manager.insert_image_record(final_data)
+                dhash, histogram = image_features.compute_features(final_data['image_path'])
+                db_manager.save_image_features([(final_data['image_id'], dhash, histogram)])
                 st.success(f"Successfully saved image '{data['image_id']}' to the catalog!")
                 st.session_state.analysis_result = None # Clear state for next upload
+                st.session_state.current_paths = None
     else:
         st.info("Upload an image and click 'Analyze with AI' to populate metadata fields.")
 
 
+# --- Batch Upload ---
+with st.expander("📦 Batch Upload"):
+    st.markdown("Upload many images at once. Each is analyzed with AI and saved to the catalog directly.")
+    batch_files = st.file_uploader("Choose image files", type=["jpg", "jpeg", "png"], accept_multiple_files=True, key="batch_files")
+    concurrency = st.slider("Concurrent API calls", min_value=1, max_value=16, value=batch_analyzer.DEFAULT_CONCURRENCY)
+    if batch_files and st.button(f"🤖 Analyze and Save {len(batch_files)} Images", type="primary"):
+        progress = st.progress(0.0, text="Starting batch...")
+
+        def show_progress(stats):
+            progress.progress(stats.done / stats.total, text=f"{stats.done}/{stats.total} images ({stats.throughput:.2f} images/s)")
+
+        stats = batch_analyzer.run_batch(batch_files, concurrency=concurrency, progress_callback=show_progress)
+        if stats.failed:
+            st.warning(stats.summary())
+            for name, error in stats.failures:
+                st.write(f"❌ {name}: {error}")
+        else:
+            st.success(stats.summary())
+
+
 # --- Display Catalog ---
-st.header("📚 Image Catalog")
-catalog_df = db_manager.get_all_images()
-if not catalog_df.empty:
-    st.markdown(f"**Total Images: {len(catalog_df)}**")
-    
-    # Display images in a grid
+# Rendition widths requested for the three-column grid and the detail view
+GRID_IMAGE_WIDTH = 512
+DETAIL_IMAGE_WIDTH = 1024
+SIMILAR_IMAGES_COUNT = 6
+
+def render_catalog_grid(rows):
+    """Displays one page of catalog rows as a three-column image grid."""
     cols = st.columns(3)
-    for idx, row in catalog_df.iterrows():
+    for idx, row in enumerate(rows):
         col_idx = idx % 3
         with cols[col_idx]:
-            # Try to display the image
+            # Try to display the image, using the smallest adequate rendition
             try:
-                if os.path.exists(row['image_path']):
-                    st.image(row['image_path'], caption=f"{row['image_id']}", use_column_width=True)
+                image = row['image_path'] and file_manager.get_rendition(row['image_path'], GRID_IMAGE_WIDTH)
+                if image and os.path.exists(image):
+                    st.image(image, caption=f"{row['image_id']}", use_column_width=True)
                 else:
                     st.info(f"📷 {row['image_id']}")
             except:
                 st.info(f"📷 {row['image_id']}")
-            
+
             st.markdown(f"**Style:** {row['style_name']}")
             st.markdown(f"**Type:** {row['image_type']}")
-            
+
             # Add expandable details
             with st.expander("View Details"):
                 st.markdown(f"**Path:** `{row['image_path']}`")
-    
-    # Also show the dataframe for easy browsing
+                if st.button("Show full metadata", key=f"details_{row['image_id']}"):
+                    st.session_state.selected_image_id = row['image_id']
+
+# --- Sidebar Facet Filters ---
+FACET_LABELS = {
+    "image_type": "Image Type",
+    "style_name": "Style",
+    "tag": "Emotional Tags",
+    "use_case": "Use Cases",
+    "color": "Colours",
+}
+
+def current_facet_filters():
+    """The facet selections made in the sidebar, as db_manager filters."""
+    return {facet: st.session_state.get(f"filter_{facet}", []) for facet in FACET_LABELS}
+
+facet_filters = current_facet_filters()
+facet_counts = db_manager.get_facet_counts(facet_filters)
+with st.sidebar:
+    st.header("🔎 Filter Catalog")
+    for facet, label in FACET_LABELS.items():
+        entries = {entry['value']: entry for entry in facet_counts[facet]}
+        # Keep current selections selectable even if they drop out of the top values
+        options = list(entries) + [value for value in facet_filters[facet] if value not in entries]
+        if not options:
+            continue
+
+        def format_option(value, entries=entries, facet=facet):
+            entry = entries.get(value)
+            if entry is None:
+                return value
+            name = f"{entry['hex']} family" if facet == "color" else value
+            return f"{name} ({entry['count']})"
+
+        st.multiselect(label, options, key=f"filter_{facet}", format_func=format_option)
+    read_cache_stats = db_manager.get_read_cache_stats()
+    st.caption(
+        f"Catalog cache: {read_cache_stats['hit_rate']:.0%} hit rate, "
+        f"{read_cache_stats['entries']} entries, {read_cache_stats['bytes'] / 1024:.0f} KB"
+    )
+active_filters = {facet: values for facet, values in facet_filters.items() if values}
+
+st.header("📚 Image Catalog")
+total_images = db_manager.count_images()
+if total_images:
+    st.markdown(f"**Total Images: {total_images}**")
+
+    # Keyset pagination: catalog_cursors[i] is the cursor that starts page i
+    if 'catalog_cursors' not in st.session_state:
+        st.session_state.catalog_cursors = [None]
+    if 'selected_image_id' not in st.session_state:
+        st.session_state.selected_image_id = None
+    if 'search_page' not in st.session_state:
+        st.session_state.search_page = 0
+
+    search_query = st.text_input("🔍 Search the catalog", placeholder="Mood, style, palette, use case...")
+    if (search_query, active_filters) != st.session_state.get('active_search'):
+        # A new query or filter starts again from the first page
+        st.session_state.active_search = (search_query, active_filters)
+        st.session_state.search_page = 0
+        st.session_state.catalog_cursors = [None]
+    searching = bool(search_query.strip())
+    page_size = db_manager.DEFAULT_PAGE_SIZE
+
+    if searching:
+        match_count = db_manager.count_search_results(search_query, filters=active_filters)
+        st.markdown(f"**Matching Images: {match_count}**")
+        page_index = st.session_state.search_page
+        page_rows = db_manager.search_images(search_query, limit=page_size, offset=page_index * page_size, filters=active_filters)
+        page_count = -(-match_count // page_size)
+        has_next = page_index + 1 < page_count
+    else:
+        filtered_count = db_manager.count_images(active_filters) if active_filters else total_images
+        if active_filters:
+            st.markdown(f"**Matching Images: {filtered_count}**")
+        page_index = len(st.session_state.catalog_cursors) - 1
+        page_rows, next_cursor = db_manager.get_images_page(after_id=st.session_state.catalog_cursors[-1], filters=active_filters)
+        page_count = -(-filtered_count // page_size)
+        has_next = next_cursor is not None
+
+    render_catalog_grid(page_rows)
+
+    # Page navigation
+    nav_prev, nav_label, nav_next = st.columns([1, 2, 1])
+    with nav_prev:
+        if st.button("⬅️ Previous", disabled=page_index == 0, use_container_width=True):
+            if searching:
+                st.session_state.search_page -= 1
+            else:
+                st.session_state.catalog_cursors.pop()
+            st.rerun()
+    with nav_label:
+        st.markdown(f"Page {page_index + 1} of {max(page_count, 1)}")
+    with nav_next:
+        if st.button("Next ➡️", disabled=not has_next, use_container_width=True):
+            if searching:
+                st.session_state.search_page += 1
+            else:
+                st.session_state.catalog_cursors.append(next_cursor)
+            st.rerun()
+
+    # Full metadata is only fetched for the image the user asked about
+    if st.session_state.selected_image_id:
+        details = db_manager.get_image_details(st.session_state.selected_image_id)
+        if details:
+            with st.expander(f"🔎 Details for {details['image_id']}", expanded=True):
+                if details['image_path']:
+                    detail_image = file_manager.get_rendition(details['image_path'], DETAIL_IMAGE_WIDTH)
+                    if os.path.exists(detail_image):
+                        st.image(detail_image, width=DETAIL_IMAGE_WIDTH)
+                st.json(dict(details))
+
+                similar_rows = db_manager.find_similar(details['image_id'], k=SIMILAR_IMAGES_COUNT)
+                if similar_rows:
+                    st.subheader("Similar Images")
+                    similar_cols = st.columns(len(similar_rows))
+                    for similar_col, similar in zip(similar_cols, similar_rows):
+                        with similar_col:
+                            thumb = similar['image_path'] and file_manager.get_rendition(similar['image_path'], 128)
+                            if thumb and os.path.exists(thumb):
+                                st.image(thumb, use_column_width=True)
+                            st.caption(f"{similar['image_id']} ({similar['similarity']:.0%})")
+                            if st.button("Open", key=f"similar_{similar['image_id']}"):
+                                st.session_state.selected_image_id = similar['image_id']
+                                st.rerun()
+                if st.button("Close details"):
+                    st.session_state.selected_image_id = None
+                    st.rerun()
+
+    # Also show the current page as a table for easy browsing
     with st.expander("📊 View as Table"):
-        st.dataframe(catalog_df, use_container_width=True)
+        st.dataframe(page_rows, use_container_width=True)
 else:
-    st.write("The catalog is empty. Upload and save an image to see it here.") 
\ No newline at end of file
+    st.write("The catalog is empty. Upload and save an image to see it here.")
+
+
+# --- Job Polling ---
+# Rerun while a background analysis is in flight so its result shows up
+# without the user having to interact with the page
+if st.session_state.job_id is not None:
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
@@ -0,0 +1,85 @@
+import streamlit as st
+from src import metrics
+
+# --- Page Config ---
+st.set_page_config(page_title="Pipeline Metrics", layout="wide")
+
+st.title("📊 Pipeline Metrics")
+st.markdown(
+    "Latency of each processing stage and OpenAI token usage, combined across the "
+    "dashboard, the background job worker and batch runs."
+)
+if st.button("🔄 Refresh"):
+    st.rerun()
+
+merged = metrics.current_metrics()
+histograms = {(h["name"], h["labels"].get("stage") or h["labels"].get("type")): h for h in merged["histograms"]}
+counters = {(c["name"], c["labels"].get("stage") or c["labels"].get("type")): c["value"] for c in merged["counters"]}
+
+# --- Stage Latency ---
+st.header("⏱️ Stage Latency")
+stages = [stage for stage in metrics.STAGES if (metrics.STAGE_DURATION, stage) in histograms]
+stages += sorted(stage for name, stage in histograms if name == metrics.STAGE_DURATION and stage not in stages)
+if not stages:
+    st.info("No metrics recorded yet. Analyze or save some images and refresh.")
+else:
+    total_seconds = sum(histograms[(metrics.STAGE_DURATION, stage)]["sum"] for stage in stages)
+
+    def ms(seconds):
+        return round(seconds * 1000, 1) if seconds is not None else None
+
+    rows = []
+    for stage in stages:
+        histogram = histograms[(metrics.STAGE_DURATION, stage)]
+        rows.append({
+            "Stage": stage,
+            "Count": histogram["count"],
+            "Mean (ms)": ms(histogram["sum"] / histogram["count"]) if histogram["count"] else None,
+            "p50 (ms)": ms(metrics.quantile(histogram, 0.50)),
+            "p95 (ms)": ms(metrics.quantile(histogram, 0.95)),
+            "p99 (ms)": ms(metrics.quantile(histogram, 0.99)),
+            "Share of time": f"{histogram['sum'] / total_seconds:.0%}" if total_seconds else "-",
+            "Errors": counters.get((metrics.STAGE_ERRORS, stage), 0),
+        })
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    st.caption("Percentiles are estimated from histogram buckets, as Prometheus does.")
+
+# --- Token Usage ---
+st.header("🪙 Token Usage & Cost")
+prompt_tokens = counters.get((metrics.API_TOKENS, "prompt"), 0)
+completion_tokens = counters.get((metrics.API_TOKENS, "completion"), 0)
+prompt_histogram = histograms.get((metrics.API_REQUEST_TOKENS, "prompt"))
+requests = prompt_histogram["count"] if prompt_histogram else 0
+cost = metrics.estimated_cost(prompt_tokens, completion_tokens)
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("API Requests", requests)
+col2.metric("Prompt Tokens", f"{prompt_tokens:,}")
+col3.metric("Completion Tokens", f"{completion_tokens:,}")
+col4.metric("Estimated Cost", f"${cost:,.2f}")
+if requests:
+    st.caption(
+        f"Per request: {prompt_tokens / requests:,.0f} prompt + {completion_tokens / requests:,.0f} completion "
+        f"tokens on average, p95 prompt {metrics.quantile(prompt_histogram, 0.95):,.0f} tokens, "
+        f"${cost / requests:.4f} each. Prices: ${metrics.INPUT_PRICE_PER_MILLION:.2f} / "
+        f"${metrics.OUTPUT_PRICE_PER_MILLION:.2f} per million input / output tokens."
+    )
+batch_prompt_tokens = counters.get((metrics.BATCH_TOKENS, "prompt"), 0)
+batch_completion_tokens = counters.get((metrics.BATCH_TOKENS, "completion"), 0)
+if batch_prompt_tokens or batch_completion_tokens:
+    batch_cost = metrics.estimated_cost(batch_prompt_tokens, batch_completion_tokens, batch=True)
+    st.caption(
+        f"Batch backfills: {batch_prompt_tokens:,} prompt + {batch_completion_tokens:,} completion tokens, "
+        f"${batch_cost:,.2f} at the {metrics.BATCH_PRICE_FACTOR:.0%} Batch API rate (not included above)."
+    )
+fallbacks = counters.get((metrics.PARSE_FALLBACKS, None), 0)
+if fallbacks:
+    st.warning(f"{fallbacks} responses could not be parsed as JSON and were stored as raw text.")
+
+# --- Prometheus Export ---
+with st.expander("Prometheus Export"):
+    st.markdown(
+        f"Written to `{metrics.METRICS_DIR}/{metrics.PROMETHEUS_FILE}` for the node_exporter textfile "
+        "collector, or print it with `python -m src.metrics`."
+    )
+    st.code(metrics.render_prometheus(merged), language="text")
@@ -0,0 +1,121 @@
+"""
+Asynchronous analysis client for analyzing many images at once.
+
+AsyncAnalyzer wraps openai.AsyncOpenAI around an explicitly sized,
+keep-alive httpx.AsyncClient, so concurrent requests reuse a fixed pool of
+connections (multiplexed over HTTP/2 when the h2 package is installed)
+instead of opening one per call. It shares the request template,
+preprocessing, JSON parsing and result cache with vision_analyzer, and
+returns the same (result, debug_info) pair per image.
+
+Example:
+    async with AsyncAnalyzer(concurrency=8) as analyzer:
+        results = await analyzer.analyze_many(paths)
+"""
+import asyncio
+import importlib.util
+import logging
+import traceback
+
+import httpx
+import openai
+
+from src import config, metrics, vision_analyzer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+KEEPALIVE_EXPIRY = 30.0
+CONNECT_TIMEOUT = 10.0
+# Vision calls regularly take 10-30 s, so reads get a generous timeout
+READ_TIMEOUT = 120.0
+WRITE_TIMEOUT = 30.0
+POOL_TIMEOUT = 30.0
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class AsyncAnalyzer:
+    """Analyzes images concurrently over a shared, pooled HTTP connection set."""
+
+    def __init__(self, api_key=None, base_url=None, concurrency=DEFAULT_CONCURRENCY, http2=None, use_cache=True):
+        self.concurrency = concurrency
+        self.use_cache = use_cache
+        self._http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE if http2 is None else http2,
+            limits=httpx.Limits(
+                max_connections=concurrency,
+                max_keepalive_connections=concurrency,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=WRITE_TIMEOUT, pool=POOL_TIMEOUT
+            ),
+            # Like the synchronous client, ignore proxy settings from the environment
+            trust_env=False,
+        )
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key or config.get_openai_api_key(),
+            base_url=base_url or config.get_openai_base_url(),
+            http_client=self._http_client,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Closes the pooled connections."""
+        await self.client.close()
+
+    async def analyze(self, image_path):
+        """
+        Analyzes one image. Returns (result_dict, debug_info), with result_dict
+        None on failure, matching vision_analyzer.analyze_image_with_gpt.
+        """
+        debug_info = []
+        try:
+            content_hash = None
+            if self.use_cache:
+                # Hashing and SQLite are blocking, so they run in a worker thread
+                content_hash, cached = await asyncio.to_thread(
+                    vision_analyzer.lookup_cached_analysis, image_path, debug_info
+                )
+                if cached is not None:
+                    return cached, debug_info
+
+            request = await asyncio.to_thread(vision_analyzer.encode_for_request, image_path, debug_info)
+            debug_info.append("🚀 Making OpenAI API call...")
+            try:
+                with metrics.span("api_request"):
+                    response = await self.client.chat.completions.create(**request)
+            except Exception as api_error:
+                debug_info.append(f"❌ API call failed: {api_error}")
+                raise
+            content = vision_analyzer.response_content(response, debug_info)
+            result = await asyncio.to_thread(
+                vision_analyzer.finish_analysis, content, image_path, content_hash, debug_info
+            )
+            return result, debug_info
+        except Exception as e:
+            error_msg = f"❌ OpenAI API error: {type(e).__name__}: {e}"
+            debug_info.append(error_msg)
+            logger.error(error_msg)
+            debug_info.append(f"Full traceback: {traceback.format_exc()}")
+            return None, debug_info
+
+    async def analyze_many(self, image_paths, concurrency=None):
+        """
+        Analyzes many images with at most `concurrency` in flight (default:
+        the pool size). Returns a list of (result_dict, debug_info) in the
+        same order as image_paths.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+
+        async def bounded(image_path):
+            async with semaphore:
+                return await self.analyze(image_path)
+
+        return await asyncio.gather(*(bounded(path) for path in image_paths))
@@ -0,0 +1,55 @@
+"""
+Generates the multi-size renditions for images already in the catalog and
+points their image_thumbnail at the smallest one.
+
+Usage:
+    python -m src.backfill_renditions
+    python -m src.backfill_renditions --force   # regenerate existing renditions too
+"""
+import argparse
+import logging
+import os
+
+from src import db_manager, file_manager
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_renditions(force=False):
+    """
+    Walks the catalog page by page, creating any missing renditions, or
+    regenerating all of them with force. Returns (updated, skipped).
+    """
+    updated = skipped = 0
+    cursor = None
+    while True:
+        rows, cursor = db_manager.get_images_page(
+            columns=("image_id", "image_path", "image_thumbnail"), after_id=cursor, limit=200
+        )
+        for row in rows:
+            if not row["image_path"] or not os.path.exists(row["image_path"]):
+                logger.warning(f"Skipping {row['image_id']}: original not found at {row['image_path']}")
+                skipped += 1
+                continue
+            thumb_path = file_manager.create_renditions(row["image_path"], force)[file_manager.RENDITION_SIZES[0]]
+            if row["image_thumbnail"] != thumb_path:
+                db_manager.update_image_thumbnail(row["image_id"], thumb_path)
+            updated += 1
+        if cursor is None:
+            return updated, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create thumbnail renditions for cataloged images.")
+    parser.add_argument("--force", action="store_true",
+                        help="Regenerate existing renditions, e.g. ones made before EXIF rotation was applied")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db_manager.create_table()
+    updated, skipped = backfill_renditions(args.force)
+    print(f"Renditions ready for {updated} images, {skipped} skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Concurrent batch analysis for bulk uploads and directory ingests.
+
+Images are saved, encoded and sent to the vision API by a bounded pool of
+worker threads; results are written to SQLite in batched transactions on the
+calling thread. Records are keyed by the image's content hash, and images
+already in the catalog are skipped unless skip_existing=False. Rate-limited calls (HTTP 429) are retried with exponential
+backoff, honouring Retry-After when the API sends it.
+
+Usage:
+    python -m src.batch_analyzer /path/to/images --concurrency 8
+
+Set OPENAI_BASE_URL to run against a local stub of the OpenAI endpoint.
+"""
+import argparse
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src import db_manager, file_manager, image_features, metrics, vision_analyzer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+# Number of analyzed records written per database transaction
+DB_BATCH_SIZE = 25
+# Rate-limit handling
+MAX_RATE_LIMIT_RETRIES = 6
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Hex digits of the content hash used in catalog IDs (64 bits)
+CATALOG_ID_HASH_CHARS = 16
+
+
+class BatchStats:
+    """Counters for one batch run, safe to update from worker threads."""
+
+    def __init__(self, total):
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.rate_limit_retries = 0
+        self.failures = []
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._claimed_ids = set()
+
+    def claim(self, image_id):
+        """True the first time image_id is seen in this batch, so duplicate files are analyzed once."""
+        with self._lock:
+            if image_id in self._claimed_ids:
+                return False
+            self._claimed_ids.add(image_id)
+            return True
+
+    def record_retry(self):
+        with self._lock:
+            self.rate_limit_retries += 1
+
+    def record_success(self):
+        with self._lock:
+            self.succeeded += 1
+
+    def record_skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def record_failure(self, name, error, succeeded_before=False):
+        """Counts a failed image; succeeded_before moves one that was analyzed but couldn't be saved."""
+        with self._lock:
+            if succeeded_before:
+                self.succeeded -= 1
+            self.failed += 1
+            self.failures.append((name, f"{type(error).__name__}: {error}"))
+
+    @property
+    def done(self):
+        return self.succeeded + self.failed + self.skipped
+
+    @property
+    def elapsed(self):
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    @property
+    def throughput(self):
+        """Completed images per second."""
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return (
+            f"Processed {self.done}/{self.total} images in {self.elapsed:.1f}s "
+            f"({self.throughput:.2f} images/s): {self.succeeded} saved, "
+            f"{self.skipped} duplicates skipped, {self.failed} failed, "
+            f"{self.rate_limit_retries} rate-limit retries"
+        )
+
+
+def is_rate_limited(error):
+    # openai.RateLimitError carries status_code 429, so this avoids importing openai here
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_after(error):
+    """Returns the server's Retry-After delay in seconds, if it sent one."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def request_with_backoff(image_path, debug_info, stats):
+    """Makes the API request for one image, backing off and retrying while the API rate-limits us."""
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        try:
+            return vision_analyzer.request_analysis(image_path, debug_info)
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == MAX_RATE_LIMIT_RETRIES:
+                raise
+            # Full jitter keeps the workers from retrying in lockstep
+            delay = retry_after(e) or random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+            stats.record_retry()
+            logger.warning(f"Rate limited on {image_path}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _source_name(source):
+    return source if isinstance(source, str) else source.name
+
+
+def catalog_id(file_path):
+    """
+    Catalog ID for a stored original. Originals are named by their SHA-256,
+    so different images never share an ID, whatever their file names.
+    """
+    content_hash = os.path.splitext(os.path.basename(file_path))[0]
+    return f"IMG-{content_hash[:CATALOG_ID_HASH_CHARS]}"
+
+
+def _process(source, stats, skip_existing=True):
+    """
+    Saves, analyzes and builds the catalog record and visual features for one
+    image. Returns None, without calling the API, for a duplicate of an
+    earlier image in the batch or (with skip_existing) of an image already in
+    the catalog, so existing records are never overwritten.
+    """
+    if isinstance(source, str):
+        file_path, thumb_path = file_manager.save_local_file(source)
+    else:
+        file_path, thumb_path = file_manager.save_uploaded_file(source)
+    # Model-suggested IDs (e.g. AI-BG-001) collide across a batch, and file
+    # names collide across directories, so bulk ingests use the content hash
+    image_id = catalog_id(file_path)
+    if not stats.claim(image_id):
+        return None
+    if skip_existing and db_manager.find_image_by_path(file_path) is not None:
+        return None
+    request = functools.partial(request_with_backoff, stats=stats)
+    record = vision_analyzer.analyze_image(file_path, request=request)
+    record['image_id'] = image_id
+    record['image_path'] = file_path
+    record['image_thumbnail'] = thumb_path
+    features = (record['image_id'],) + image_features.compute_features(file_path)
+    return record, features
+
+
+def _write_group(results):
+    with db_manager.transaction():
+        db_manager.insert_image_records([record for _, record, _ in results])
+        db_manager.save_image_features([features for _, _, features in results])
+
+
+def _write_results(results, stats):
+    """
+    Writes a group of (name, record, features) results in one transaction.
+    If the group fails, each result is retried on its own, so one bad record
+    costs only its own analysis; those that still fail are counted as failures.
+    """
+    try:
+        _write_group(results)
+        return
+    except Exception as e:
+        logger.error(f"Failed to save a group of {len(results)} records, saving them one by one: {e}")
+    for result in results:
+        try:
+            _write_group([result])
+        except Exception as e:
+            logger.error(f"Failed to save {result[0]}: {e}")
+            stats.record_failure(result[0], e, succeeded_before=True)
+
+
+def run_batch(sources, concurrency=DEFAULT_CONCURRENCY, progress_callback=None, skip_existing=True):
+    """
+    Analyzes and catalogs a batch of images.
+    sources may be local file paths or Streamlit uploaded files.
+    progress_callback, if given, is called as progress_callback(stats) after
+    each image completes. With skip_existing=False, images already in the
+    catalog are analyzed again and their batch-ingested record replaced.
+    Returns the BatchStats for the run.
+    """
+    sources = list(sources)
+    stats = BatchStats(len(sources))
+    db_manager.create_table()
+    pending = []
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="analyzer") as executor:
+        futures = {executor.submit(_process, source, stats, skip_existing): source for source in sources}
+        for future in as_completed(futures):
+            name = _source_name(futures[future])
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Failed to analyze {name}: {e}")
+                stats.record_failure(name, e)
+            else:
+                if result is None:
+                    stats.record_skip()
+                else:
+                    pending.append((name,) + result)
+                    stats.record_success()
+            if len(pending) >= DB_BATCH_SIZE:
+                _write_results(pending, stats)
+                pending = []
+            if progress_callback:
+                progress_callback(stats)
+
+    if pending:
+        _write_results(pending, stats)
+    stats.finished_at = time.perf_counter()
+    logger.info(stats.summary())
+    metrics.flush_pending()
+    return stats
+
+
+def find_images(directory, recursive=False):
+    """Lists the image files in a directory, sorted by path."""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(
+            os.path.join(root, name) for name in files
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not recursive:
+            break
+    return sorted(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze and catalog every image in a directory.")
+    parser.add_argument("directory", help="Directory containing JPG/PNG images")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Maximum number of concurrent API calls")
+    parser.add_argument("--recursive", action="store_true", help="Also ingest subdirectories")
+    args = parser.parse_args()
+
+    paths = find_images(args.directory, recursive=args.recursive)
+    if not paths:
+        print(f"No images found in {args.directory}")
+        return
+
+    def report(stats):
+        print(f"\r{stats.done}/{stats.total} ({stats.throughput:.2f} images/s)", end="", flush=True)
+
+    stats = run_batch(paths, concurrency=args.concurrency, progress_callback=report)
+    print()
+    print(stats.summary())
+    for name, error in stats.failures:
+        print(f"  FAILED {name}: {error}")
+
+
+if __name__ == "__main__":
+    main()
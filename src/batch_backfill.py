@@ -0,0 +1,394 @@
+"""
+Re-analysis of the catalog through the OpenAI Batch API.
+
+Every record stores the prompt_version it was analyzed with. After the system
+prompt changes, a backfill finds the stale records, writes their
+chat-completions requests into JSONL batch input files, uploads them and
+creates batches, which the API completes within 24 hours at half the price of
+synchronous calls. Polling picks up finished batches and applies each one's
+results in a single transaction, parsed the same way as interactive analyses.
+
+Batches are tracked in the analysis_batches table, so polling can resume in
+another process and images waiting in an unapplied batch aren't submitted
+twice. Images whose content already has a cached analysis for the current
+prompt are updated right away without a request.
+
+Usage:
+    python -m src.batch_backfill submit --limit 5000
+    python -m src.batch_backfill poll --wait
+    python -m src.batch_backfill status
+
+Set OPENAI_BASE_URL to run against a local stub (python -m benchmarks.mock_openai).
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import db_manager, metrics, vision_analyzer
+
+logger = logging.getLogger(__name__)
+
+BATCH_DIR = os.getenv("BATCH_DIR", "/app/data/batches")
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# The Batch API accepts up to 50,000 requests and 200 MB per input file
+MAX_REQUESTS_PER_FILE = 50000
+MAX_FILE_BYTES = 190 * 1024 * 1024
+# Images hashed and encoded concurrently while writing batch files
+ENCODE_WORKERS = min(8, os.cpu_count() or 1)
+POLL_INTERVAL = 60.0
+# Catalog records read per query while applying results
+APPLY_CHUNK_SIZE = 500
+
+# Statuses after which the API does no more work on a batch. Expired and
+# cancelled batches still return the requests they finished.
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Columns filled in by an analysis; the rest belong to the catalog
+ANALYSIS_COLUMNS = tuple(
+    column for column in db_manager.IMAGE_COLUMNS
+    if column not in ("image_id", "image_path", "image_thumbnail", "prompt_version")
+)
+
+
+def _client():
+    client = vision_analyzer.get_client()
+    if not client:
+        raise RuntimeError(f"OpenAI client not initialized. Init error: {vision_analyzer.init_error}")
+    return client
+
+
+def _updated_records(analyses, prompt_version, image_paths):
+    """
+    Merges analyses ({image_id: analysis dict}) into the current catalog
+    records. Images deleted, replaced with a different file, or already
+    re-analyzed with prompt_version since the request was made are left out.
+    """
+    records = []
+    image_ids = list(analyses)
+    for start in range(0, len(image_ids), APPLY_CHUNK_SIZE):
+        for record in db_manager.get_image_records(image_ids[start:start + APPLY_CHUNK_SIZE]):
+            image_id = record["image_id"]
+            if record["image_path"] != image_paths[image_id] or record["prompt_version"] == prompt_version:
+                continue
+            analysis = analyses[image_id]
+            for column in ANALYSIS_COLUMNS:
+                if column in analysis:
+                    value = analysis[column]
+                    # Tag-like fields are comma-separated text; a list or number from the
+                    # model must not fail the whole batch's transaction
+                    if isinstance(value, list):
+                        value = ", ".join(str(item) for item in value)
+                    elif value is not None and not isinstance(value, str):
+                        value = str(value)
+                    record[column] = value
+            record["prompt_version"] = prompt_version
+            records.append(record)
+    return records
+
+
+# --- Building and Submitting ---
+
+def _prepare(row):
+    """
+    Hashes one image and either finds a cached analysis for it or encodes its
+    request. Returns (content_hash, cached_analysis, request_line), or None
+    if the image couldn't be read.
+    """
+    image_id, image_path = row
+    debug_info = []
+    try:
+        content_hash, cached = vision_analyzer.lookup_cached_analysis(image_path, debug_info)
+        if cached is not None:
+            return content_hash, cached, None
+        request = vision_analyzer.encode_for_request(image_path, debug_info)
+    except Exception as e:
+        logger.error(f"Skipping {image_id}: can't encode {image_path}: {type(e).__name__}: {e}")
+        return None
+    line = json.dumps({"custom_id": image_id, "method": "POST", "url": ENDPOINT, "body": request})
+    return content_hash, None, line
+
+
+def _prepared(rows, stats):
+    """Yields (image_id, image_path, content_hash, cached_analysis, request_line), encoding in parallel."""
+    readable = []
+    for image_id, image_path in rows:
+        if image_path and os.path.exists(image_path):
+            readable.append((image_id, image_path))
+        else:
+            logger.warning(f"Skipping {image_id}: original not found at {image_path}")
+            stats["missing"] += 1
+    group_size = ENCODE_WORKERS * 4
+    with ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encoder") as executor:
+        # Encoded requests are large, so only a few groups are held in memory at a time
+        for start in range(0, len(readable), group_size):
+            group = readable[start:start + group_size]
+            for row, prepared in zip(group, executor.map(_prepare, group)):
+                if prepared is None:
+                    stats["failed"] += 1
+                else:
+                    yield row + prepared
+
+
+class _BatchFile:
+    """A JSONL batch input file being written, with the images it covers."""
+
+    def __init__(self, batch_dir):
+        fd, self.path = tempfile.mkstemp(
+            dir=batch_dir, prefix=f"backfill-{vision_analyzer.PROMPT_VERSION}-", suffix=".jsonl"
+        )
+        self.file = os.fdopen(fd, "w", encoding="utf-8")
+        self.items = []
+        self.size = 0
+
+    def fits(self, line):
+        return len(self.items) < MAX_REQUESTS_PER_FILE and self.size + len(line) + 1 <= MAX_FILE_BYTES
+
+    def write(self, line, item):
+        self.file.write(line)
+        self.file.write("\n")
+        self.size += len(line) + 1
+        self.items.append(item)
+
+
+def submit_batch_file(path, items):
+    """
+    Uploads a batch input file, creates its batch and records it with its
+    (image_id, image_path, content_hash) items. Returns the batch id.
+    """
+    client = _client()
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata={"prompt_version": vision_analyzer.PROMPT_VERSION},
+    )
+    db_manager.save_analysis_batch(
+        batch.id, input_file.id, vision_analyzer.PROMPT_VERSION, vision_analyzer.MODEL, batch.status, items
+    )
+    logger.info(f"Submitted batch {batch.id} with {len(items)} requests")
+    return batch.id
+
+
+def _finish_file(batch_file, stats, dry_run):
+    batch_file.file.close()
+    stats["requests"] += len(batch_file.items)
+    if dry_run:
+        stats["files"].append(batch_file.path)
+        return
+    stats["batches"].append(submit_batch_file(batch_file.path, batch_file.items))
+    # The API keeps its own copy of the input
+    os.remove(batch_file.path)
+
+
+def _apply_cached(cached, stats):
+    """Writes (image_id, image_path, analysis) results found in the analysis cache."""
+    if not cached:
+        return
+    records = _updated_records(
+        {image_id: analysis for image_id, _, analysis in cached},
+        vision_analyzer.PROMPT_VERSION,
+        {image_id: image_path for image_id, image_path, _ in cached},
+    )
+    db_manager.insert_image_records(records)
+    stats["cached"] += len(records)
+
+
+def submit_backfill(limit=None, include_manual=False, batch_dir=None, dry_run=False):
+    """
+    Submits every stale record (up to limit) for re-analysis with the current
+    prompt. With dry_run=True the batch files are only written, and left in
+    batch_dir. Returns counts plus the new batch ids (or file paths).
+    """
+    db_manager.create_table()
+    batch_dir = batch_dir or BATCH_DIR
+    os.makedirs(batch_dir, exist_ok=True)
+    rows = db_manager.get_stale_images(vision_analyzer.PROMPT_VERSION, limit, include_manual)
+    stats = {"stale": len(rows), "cached": 0, "missing": 0, "failed": 0, "requests": 0, "batches": [], "files": []}
+    logger.info(f"{len(rows)} records need analysis with prompt {vision_analyzer.PROMPT_VERSION}")
+
+    batch_file = None
+    cached = []
+    try:
+        for image_id, image_path, content_hash, analysis, line in _prepared(rows, stats):
+            if analysis is not None:
+                cached.append((image_id, image_path, analysis))
+                if len(cached) >= APPLY_CHUNK_SIZE:
+                    _apply_cached(cached, stats)
+                    cached = []
+                continue
+            if batch_file is not None and not batch_file.fits(line):
+                _finish_file(batch_file, stats, dry_run)
+                batch_file = None
+            if batch_file is None:
+                batch_file = _BatchFile(batch_dir)
+            batch_file.write(line, (image_id, image_path, content_hash))
+        if batch_file is not None:
+            _finish_file(batch_file, stats, dry_run)
+            batch_file = None
+        _apply_cached(cached, stats)
+    finally:
+        # A file that wasn't submitted would never be cleaned up otherwise
+        if batch_file is not None:
+            batch_file.file.close()
+            os.remove(batch_file.path)
+    return stats
+
+
+# --- Polling and Applying ---
+
+def _read_result_file(client, file_id):
+    """Returns the entries of a batch output or error file."""
+    if not file_id:
+        return []
+    text = client.files.content(file_id).text
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def apply_batch(batch, client=None):
+    """
+    Parses a finished batch's results and writes them to the catalog, in one
+    transaction that also marks the batch applied. Requests that failed or
+    whose response couldn't be parsed as JSON leave their record stale, so
+    the next backfill retries them. Returns counts.
+    """
+    client = client or _client()
+    batch_id, prompt_version = batch["batch_id"], batch["prompt_version"]
+    items = db_manager.get_analysis_batch_items(batch_id)
+    entries = _read_result_file(client, batch["output_file_id"]) + _read_result_file(client, batch["error_file_id"])
+    stats = {"requests": len(items), "applied": 0, "unparsed": 0, "failed": 0, "skipped": 0}
+
+    analyses = {}
+    with db_manager.transaction():
+        for entry in entries:
+            image_id = entry.get("custom_id")
+            if image_id not in items or image_id in analyses:
+                continue
+            response = entry.get("response") or {}
+            if entry.get("error") or response.get("status_code") != 200:
+                error = entry.get("error") or response.get("body", {}).get("error")
+                logger.warning(f"Batch {batch_id}: request for {image_id} failed: {error}")
+                continue
+            body = response["body"]
+            metrics.record_token_usage(body.get("usage"), batch=True)
+            content = body["choices"][0]["message"]["content"]
+            image_path, content_hash = items[image_id]
+            # Without the fallback: a raw-text placeholder must not overwrite a good record.
+            # Cached under the batch's prompt, which may no longer be the current one.
+            analysis = vision_analyzer.finish_analysis(
+                content, image_path, content_hash, [], fallback=False,
+                prompt_version=prompt_version, model=batch["model"],
+            )
+            if analysis is None:
+                stats["unparsed"] += 1
+            else:
+                analyses[image_id] = analysis
+
+        records = _updated_records(analyses, prompt_version, {image_id: path for image_id, (path, _) in items.items()})
+        db_manager.apply_analysis_batch(batch_id, records)
+
+    stats["applied"] = len(records)
+    stats["skipped"] = len(analyses) - len(records)
+    # Includes requests an expired or cancelled batch never got to
+    stats["failed"] = len(items) - len(analyses) - stats["unparsed"]
+    logger.info(
+        f"Applied batch {batch_id}: {stats['applied']} updated, {stats['skipped']} skipped, "
+        f"{stats['unparsed']} unparseable, {stats['failed']} failed"
+    )
+    return stats
+
+
+def poll_batches():
+    """
+    Refreshes the status of every unapplied batch and applies those the API
+    has finished. Returns (still_running, applied) where applied is a list of
+    (batch_id, stats).
+    """
+    client = _client()
+    running, applied = 0, []
+    for batch in db_manager.get_analysis_batches(unapplied_only=True):
+        remote = client.batches.retrieve(batch["batch_id"])
+        batch.update(status=remote.status, output_file_id=remote.output_file_id, error_file_id=remote.error_file_id)
+        db_manager.update_analysis_batch(batch["batch_id"], remote.status, remote.output_file_id, remote.error_file_id)
+        if remote.status in FINISHED_STATUSES:
+            applied.append((batch["batch_id"], apply_batch(batch, client)))
+        else:
+            running += 1
+    metrics.flush_pending()
+    return running, applied
+
+
+def wait_for_batches(interval=POLL_INTERVAL):
+    """Polls until every submitted batch is applied. Returns the applied (batch_id, stats) list."""
+    applied = []
+    while True:
+        running, newly_applied = poll_batches()
+        applied.extend(newly_applied)
+        if not running:
+            return applied
+        logger.info(f"{running} batches still running; checking again in {interval:.0f}s")
+        time.sleep(interval)
+
+
+def _print_applied(applied):
+    for batch_id, stats in applied:
+        print(
+            f"{batch_id}: {stats['applied']} of {stats['requests']} records updated, {stats['skipped']} skipped, "
+            f"{stats['unparsed']} unparseable, {stats['failed']} failed"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-analyze stale catalog records through the OpenAI Batch API.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    submit_parser = subparsers.add_parser("submit", help="Submit records analyzed with another prompt version")
+    submit_parser.add_argument("--limit", type=int, help="Maximum number of records to submit")
+    submit_parser.add_argument("--include-manual", action="store_true", help="Also re-analyze manually entered records")
+    submit_parser.add_argument("--batch-dir", default=BATCH_DIR, help="Where batch input files are written")
+    submit_parser.add_argument("--dry-run", action="store_true", help="Only write the batch files")
+    poll_parser = subparsers.add_parser("poll", help="Check submitted batches and apply finished ones")
+    for subparser in (submit_parser, poll_parser):
+        subparser.add_argument("--wait", action="store_true", help="Keep polling until every batch is applied")
+        subparser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="Seconds between polls")
+    subparsers.add_parser("status", help="List submitted batches")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db_manager.create_table()
+    if args.command == "status":
+        for batch in db_manager.get_analysis_batches():
+            applied = time.strftime("%Y-%m-%d %H:%M", time.localtime(batch["applied_at"])) if batch["applied_at"] else "-"
+            print(
+                f"{batch['batch_id']}  {batch['status']:<11} {batch['request_count']:>6} requests  "
+                f"prompt {batch['prompt_version']}  applied {applied}"
+            )
+        return
+
+    if args.command == "submit":
+        stats = submit_backfill(args.limit, args.include_manual, args.batch_dir, args.dry_run)
+        print(
+            f"{stats['stale']} stale records: {stats['cached']} updated from the analysis cache, "
+            f"{stats['requests']} requests in {len(stats['batches'] or stats['files'])} batch files, "
+            f"{stats['missing']} missing files, {stats['failed']} unreadable"
+        )
+        for path in stats["files"]:
+            print(f"Wrote {path}")
+        if args.dry_run or not args.wait:
+            return
+
+    if args.wait:
+        applied = wait_for_batches(args.interval)
+    else:
+        running, applied = poll_batches()
+        print(f"{running} batches still running")
+    _print_applied(applied)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Bounded, thread-safe LRU cache for catalog reads.
+
+db_manager keys cached reads by the catalog generation, a counter bumped by
+every write to the images table, so a write anywhere (any process) makes
+older entries unreachable and they are dropped.
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+
+def freeze(value):
+    """Turns call arguments (lists, dicts) into a hashable cache key."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def copy_result(value):
+    """Copies lists/dicts/tuples so callers can't modify what the cache holds."""
+    if isinstance(value, list):
+        return [copy_result(v) for v in value]
+    if isinstance(value, dict):
+        return {k: copy_result(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return tuple(copy_result(v) for v in value)
+    return value
+
+
+def estimate_size(value):
+    """Approximate memory held by a cached value, in bytes."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(v) for v in value)
+    elif hasattr(value, "keys"):
+        # sqlite3.Row
+        size += sum(estimate_size(v) for v in value)
+    return size
+
+
+class LRUCache:
+    """Least-recently-used cache with hit/miss and memory accounting."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, generation, key, compute):
+        """
+        Returns a copy of the cached value for key at this generation,
+        computing and storing it on a miss. Seeing a new generation drops
+        every older entry.
+        """
+        with self._lock:
+            if generation != self._generation:
+                self._clear()
+                self._generation = generation
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy_result(entry[0])
+            self.misses += 1
+
+        value = compute()
+        size = estimate_size(value)
+        with self._lock:
+            if generation == self._generation and key not in self._entries:
+                self._entries[key] = (value, size)
+                self._bytes += size
+                while len(self._entries) > self.max_entries:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self._bytes -= evicted_size
+        return copy_result(value)
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+            self._generation = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+            }
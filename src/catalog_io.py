@@ -0,0 +1,256 @@
+"""
+Bulk export and import of the catalog as Parquet or JSON Lines.
+
+Exports stream the images table in chunks, so memory use doesn't grow with
+the catalog, and write a manifest of each image's original and thumbnail
+renditions alongside. Imports are validated against the images table's
+columns and written with executemany in a single transaction: either every
+row is imported or none is.
+
+Parquet needs the optional pyarrow package; JSON Lines works everywhere.
+
+Usage:
+    python -m src.catalog_io export catalog.parquet
+    python -m src.catalog_io import catalog.parquet
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+from src import db_manager, file_manager
+
+FORMATS = ("parquet", "jsonl")
+CHUNK_SIZE = 5000
+MANIFEST_SUFFIX = ".thumbnails.jsonl"
+
+
+class CatalogImportError(ValueError):
+    """Raised when an import file doesn't match the catalog schema."""
+
+
+def detect_format(path, file_format=None):
+    """Returns the file format, from file_format or the file extension."""
+    if file_format:
+        if file_format not in FORMATS:
+            raise ValueError(f"Unknown format {file_format!r}; use one of {', '.join(FORMATS)}")
+        return file_format
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Can't tell the format of {path}; pass --format")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet support needs pyarrow: pip install pyarrow") from None
+    return pyarrow, pyarrow.parquet
+
+
+def manifest_path_for(path):
+    """Default manifest path: the export path with its extension replaced."""
+    return os.path.splitext(path)[0] + MANIFEST_SUFFIX
+
+
+# --- Export ---
+
+def _manifest_entry(row):
+    record = dict(zip(db_manager.IMAGE_COLUMNS, row))
+    image_path = record["image_path"]
+    renditions = {}
+    if image_path:
+        for size in file_manager.RENDITION_SIZES:
+            path = file_manager.rendition_path(image_path, size)
+            if os.path.exists(path):
+                renditions[str(size)] = path
+    return {
+        "image_id": record["image_id"],
+        "image_path": image_path,
+        "original_exists": bool(image_path) and os.path.exists(image_path),
+        "image_thumbnail": record["image_thumbnail"],
+        "renditions": renditions,
+    }
+
+
+def _write_jsonl(f, chunk):
+    for row in chunk:
+        f.write(json.dumps(dict(zip(db_manager.IMAGE_COLUMNS, row)), ensure_ascii=False))
+        f.write("\n")
+
+
+def export_catalog(path, file_format=None, manifest_path=None, chunk_size=CHUNK_SIZE):
+    """
+    Writes every catalog row to path, chunk by chunk, plus a thumbnails
+    manifest (JSON Lines) unless manifest_path is False. Files are written
+    under a temporary name and renamed when complete. Returns the row count.
+    """
+    file_format = detect_format(path, file_format)
+    if manifest_path is None:
+        manifest_path = manifest_path_for(path)
+    tmp_path = f"{path}.tmp"
+    tmp_manifest = f"{manifest_path}.tmp" if manifest_path else None
+    count = 0
+    try:
+        writer = manifest = None
+        try:
+            if file_format == "parquet":
+                pa, pq = _import_pyarrow()
+                schema = pa.schema([(column, pa.string()) for column in db_manager.IMAGE_COLUMNS])
+                writer = pq.ParquetWriter(tmp_path, schema)
+            else:
+                writer = open(tmp_path, "w", encoding="utf-8")
+            if tmp_manifest:
+                manifest = open(tmp_manifest, "w", encoding="utf-8")
+
+            for chunk in db_manager.iter_image_rows(chunk_size):
+                if file_format == "parquet":
+                    # Each chunk becomes one Parquet row group
+                    writer.write_table(pa.Table.from_arrays(
+                        [pa.array(values, pa.string()) for values in zip(*chunk)], schema=schema
+                    ))
+                else:
+                    _write_jsonl(writer, chunk)
+                if manifest:
+                    for row in chunk:
+                        manifest.write(json.dumps(_manifest_entry(row)))
+                        manifest.write("\n")
+                count += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+            if manifest is not None:
+                manifest.close()
+    except BaseException:
+        for tmp in (tmp_path, tmp_manifest):
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+
+    os.replace(tmp_path, path)
+    if tmp_manifest:
+        os.replace(tmp_manifest, manifest_path)
+    return count
+
+
+# --- Import ---
+
+def read_records(path, file_format=None, chunk_size=CHUNK_SIZE):
+    """Yields the records in an export file as lists of up to chunk_size dicts."""
+    file_format = detect_format(path, file_format)
+    if file_format == "parquet":
+        _, pq = _import_pyarrow()
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+        return
+
+    with open(path, encoding="utf-8") as f:
+        chunk = []
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CatalogImportError(f"Line {line_number}: invalid JSON ({e})") from None
+            if not isinstance(record, dict):
+                raise CatalogImportError(f"Line {line_number}: expected a JSON object")
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def check_schema():
+    """Raises CatalogImportError if the database's images table differs from IMAGE_COLUMNS."""
+    table_columns = db_manager.get_image_table_columns()
+    if set(table_columns) != set(db_manager.IMAGE_COLUMNS):
+        raise CatalogImportError(
+            f"The images table has columns {', '.join(table_columns)}; expected "
+            f"{', '.join(db_manager.IMAGE_COLUMNS)}"
+        )
+
+
+def validate_records(records, first_number, seen_ids):
+    """
+    Checks a chunk of records against the catalog schema and returns them as
+    tuples in IMAGE_COLUMNS order. Missing columns import as NULL. Raises
+    CatalogImportError naming the first bad record (numbered from 1).
+    """
+    rows = []
+    for number, record in enumerate(records, first_number):
+        unknown = [key for key in record if key not in db_manager.IMAGE_COLUMNS]
+        if unknown:
+            raise CatalogImportError(f"Record {number}: unknown columns {', '.join(unknown)}")
+        image_id = record.get("image_id")
+        if not isinstance(image_id, str) or not image_id.strip():
+            raise CatalogImportError(f"Record {number}: image_id is missing or empty")
+        if image_id in seen_ids:
+            raise CatalogImportError(f"Record {number}: duplicate image_id {image_id!r}")
+        seen_ids.add(image_id)
+        row = tuple(record.get(column) for column in db_manager.IMAGE_COLUMNS)
+        for column, value in zip(db_manager.IMAGE_COLUMNS, row):
+            if value is not None and not isinstance(value, str):
+                raise CatalogImportError(
+                    f"Record {number} ({image_id}): {column} must be text, not {type(value).__name__}"
+                )
+        rows.append(row)
+    return rows
+
+
+def _validated_chunks(path, file_format, chunk_size):
+    seen_ids = set()
+    number = 1
+    for records in read_records(path, file_format, chunk_size):
+        yield validate_records(records, number, seen_ids)
+        number += len(records)
+
+
+def import_catalog(path, file_format=None, chunk_size=CHUNK_SIZE):
+    """
+    Imports an export file into the catalog in one transaction. Rows with an
+    existing image_id replace it. Returns the number of rows imported.
+    """
+    db_manager.create_table()
+    check_schema()
+    return db_manager.import_image_rows(_validated_chunks(path, file_format, chunk_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the image catalog.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write the catalog to a Parquet or JSONL file")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--manifest", help=f"Thumbnails manifest path (default: <path>{MANIFEST_SUFFIX})")
+    export_parser.add_argument("--no-manifest", action="store_true", help="Skip the thumbnails manifest")
+    import_parser = subparsers.add_parser("import", help="Load a Parquet or JSONL export into the catalog")
+    import_parser.add_argument("path")
+    for subparser in (export_parser, import_parser):
+        subparser.add_argument("--format", choices=FORMATS, help="File format (default: from the extension)")
+        subparser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows per chunk")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+    if args.command == "export":
+        manifest = False if args.no_manifest else args.manifest
+        count = export_catalog(args.path, args.format, manifest, args.chunk_size)
+        print(f"Exported {count} images to {args.path} in {time.perf_counter() - started:.1f}s")
+    else:
+        try:
+            count = import_catalog(args.path, args.format, args.chunk_size)
+        except CatalogImportError as e:
+            parser.exit(1, f"Import failed, nothing was written: {e}\n")
+        print(f"Imported {count} images from {args.path} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
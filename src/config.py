@@ -10,4 +10,12 @@ def get_openai_api_key():
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("OPENAI_API_KEY not found in environment variables.")
-    return api_key 
\ No newline at end of file
+    return api_key 
+
+def get_openai_base_url():
+    """
+    Returns an alternative OpenAI API base URL, if one is configured.
+    Lets the analyzers be pointed at a local stub server for testing.
+    """
+    load_dotenv()
+    return os.getenv("OPENAI_BASE_URL") or None
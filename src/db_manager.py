@@ -1,72 +1,1096 @@
 import sqlite3
+import functools
+import json
 import os
-import pandas as pd
+import re
+import threading
+import time
+from contextlib import contextmanager
+from src import catalog_cache, facets, metrics
 
 # This path points to the persistent volume inside the container
 DB_PATH = "/app/data/catalog.db"
 
-# Ensure the data directory exists
-os.makedirs("/app/data", exist_ok=True)
+# --- Connection Settings ---
+# How long SQLite itself waits on a locked database before raising (seconds)
+BUSY_TIMEOUT = 5.0
+# Extra application-level retries for "database is locked" errors
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.05
+
+# Applied to every new connection. WAL lets readers and a writer work at the
+# same time, which is what several Streamlit sessions need.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,  # negative = KiB, so ~64 MB
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+    # INSERT OR REPLACE only fires DELETE triggers (which keep the search
+    # index in sync) when recursive triggers are enabled
+    "recursive_triggers": "ON",
+}
+
+# Column order of the images table, as created by create_table()
+IMAGE_COLUMNS = (
+    "image_id", "image_path", "image_thumbnail", "image_type", "style_name",
+    "composition_structure", "color_palette", "lighting", "texture_finish",
+    "geometry_flow", "primary_emotional_tone", "emotional_keyword_tags",
+    "narrative_metaphor", "ai_generation_prompt", "recreation_guidelines",
+    "recommended_use_cases", "prompt_version",
+)
+
+# The short columns the catalog grid needs; the long text fields are only
+# loaded on demand through get_image_details()
+GRID_COLUMNS = ("image_id", "image_path", "image_thumbnail", "image_type", "style_name")
+
+DEFAULT_PAGE_SIZE = 24
+
+# prompt_version of records entered or pasted by hand rather than analyzed;
+# batch backfills leave them alone unless asked to include them
+MANUAL_PROMPT_VERSION = "manual"
+
+# Text fields indexed by the images_fts full-text table
+FTS_COLUMNS = (
+    "style_name", "image_type", "primary_emotional_tone", "emotional_keyword_tags",
+    "recommended_use_cases", "narrative_metaphor", "composition_structure",
+    "color_palette", "lighting", "texture_finish", "geometry_flow",
+    "ai_generation_prompt", "recreation_guidelines",
+)
+
+# --- Analysis Job Queue ---
+# Job statuses: queued -> running -> done, or back to queued for a retry, or
+# failed once max_attempts is used up
+JOB_MAX_ATTEMPTS = 3
+# A running job not updated for this long is assumed to belong to a dead
+# worker and is handed out again
+JOB_LEASE_SECONDS = 300
+
+# Cached catalog reads (pages, details, counts, facets) kept per process
+READ_CACHE_MAX_ENTRIES = 512
+_read_cache = catalog_cache.LRUCache(READ_CACHE_MAX_ENTRIES)
+
+# --- Connection Pool ---
+# Idle connections kept for reuse by any thread. Streamlit runs every rerun of
+# a session's script on a new thread, so per-thread connections would be
+# reopened (and their pragmas re-run) on every rerun.
+POOL_SIZE = 16
+_pool = []  # (db_path, connection)
+_pool_lock = threading.Lock()
+# The connection this thread has checked out, shared by nested use
+_local = threading.local()
+
+# Database paths whose schema this process has already created/migrated
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+def _open_connection():
+    # Ensure the data directory exists
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+    # isolation_level=None: transactions are opened explicitly by transaction().
+    # A pooled connection is used by one thread at a time, but not always the same one.
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS.items():
+        _with_retry(conn.execute, f"PRAGMA {name}={value}")
+    return conn
+
+
+def _acquire():
+    """Takes an idle connection to DB_PATH from the pool, or opens one. Returns (path, connection)."""
+    stale = []
+    conn = None
+    with _pool_lock:
+        while _pool and conn is None:
+            path, candidate = _pool.pop()
+            if path == DB_PATH:
+                conn = candidate
+            else:
+                stale.append(candidate)
+    for candidate in stale:
+        candidate.close()
+    return DB_PATH, conn or _open_connection()
+
+
+def _release(path, conn):
+    """Returns a connection to the pool, closing it if the pool is full or DB_PATH changed."""
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if path == DB_PATH and len(_pool) < POOL_SIZE:
+            _pool.append((path, conn))
+            return
+    conn.close()
+
+
+@contextmanager
+def connection():
+    """
+    Checks a connection out of the pool for the enclosed statements and
+    returns it afterwards. Nested use on the same thread shares the outer
+    connection, so reads inside a transaction see its writes.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+    path, conn = _acquire()
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        _release(path, conn)
+
+
+def close_connection():
+    """Closes the idle pooled connections, e.g. before pointing DB_PATH elsewhere."""
+    with _pool_lock:
+        idle = [conn for _, conn in _pool]
+        _pool.clear()
+    for conn in idle:
+        conn.close()
+
+
+def _is_busy_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _with_retry(func, *args):
+    """Calls func, retrying with exponential backoff while the database is busy."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as e:
+            if not _is_busy_error(e) or attempt == MAX_RETRIES:
+                raise
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+
+@contextmanager
+def transaction():
+    """
+    Runs the enclosed statements in a single write transaction.
+    BEGIN IMMEDIATE takes the write lock up front so concurrent writers wait on
+    the busy timeout instead of failing mid-transaction. Nested use joins the
+    outer transaction.
+    """
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        _with_retry(conn.execute, "BEGIN IMMEDIATE")
+        try:
+            yield conn
+            _with_retry(conn.commit)
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
 
 def create_table():
     """Creates the images table if it doesn't exist, based on the full schema."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS images (
-        image_id TEXT PRIMARY KEY,
-        image_path TEXT,
-        image_thumbnail TEXT,
-        image_type TEXT,
-        style_name TEXT,
-        composition_structure TEXT,
-        color_palette TEXT,
-        lighting TEXT,
-        texture_finish TEXT,
-        geometry_flow TEXT,
-        primary_emotional_tone TEXT,
-        emotional_keyword_tags TEXT,
-        narrative_metaphor TEXT,
-        ai_generation_prompt TEXT,
-        recreation_guidelines TEXT,
-        recommended_use_cases TEXT
-    )
+    with transaction() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS images (
+            image_id TEXT PRIMARY KEY,
+            image_path TEXT,
+            image_thumbnail TEXT,
+            image_type TEXT,
+            style_name TEXT,
+            composition_structure TEXT,
+            color_palette TEXT,
+            lighting TEXT,
+            texture_finish TEXT,
+            geometry_flow TEXT,
+            primary_emotional_tone TEXT,
+            emotional_keyword_tags TEXT,
+            narrative_metaphor TEXT,
+            ai_generation_prompt TEXT,
+            recreation_guidelines TEXT,
+            recommended_use_cases TEXT,
+            prompt_version TEXT
+        )
+        """)
+        # Catalogs created before prompt versions were tracked
+        if "prompt_version" not in {row["name"] for row in conn.execute("PRAGMA table_info(images)")}:
+            conn.execute("ALTER TABLE images ADD COLUMN prompt_version TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_prompt_version ON images (prompt_version)")
+        # Originals are content-addressed, so this finds an image by its content
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_image_path ON images (image_path)")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """)
+        conn.execute("INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('generation', 0)")
+        _create_search_index(conn)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            content_hash TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            model TEXT NOT NULL,
+            result_json TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (content_hash, prompt_version, model)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            image_path TEXT NOT NULL,
+            image_thumbnail TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            result_json TEXT,
+            debug_json TEXT,
+            error TEXT,
+            available_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs (status, available_at)")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS image_features (
+            image_id TEXT PRIMARY KEY,
+            dhash INTEGER NOT NULL,
+            histogram BLOB NOT NULL
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_batches (
+            batch_id TEXT PRIMARY KEY,
+            input_file_id TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            model TEXT NOT NULL,
+            status TEXT NOT NULL,
+            request_count INTEGER NOT NULL,
+            output_file_id TEXT,
+            error_file_id TEXT,
+            applied_at REAL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_batch_items (
+            batch_id TEXT NOT NULL,
+            image_id TEXT NOT NULL,
+            image_path TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            PRIMARY KEY (batch_id, image_id)
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_batch_items_image ON analysis_batch_items (image_id)")
+        _create_facet_tables(conn)
+
+
+def ensure_schema():
+    """
+    Runs create_table() once per process for the current DB_PATH. Meant for
+    code that runs repeatedly, like the dashboard script on every rerun.
+    """
+    if DB_PATH in _schema_ready:
+        return
+    with _schema_lock:
+        if DB_PATH not in _schema_ready:
+            create_table()
+            _schema_ready.add(DB_PATH)
+
+
+# Secondary indexes of the facet tables, as (name, definition)
+FACET_INDEXES = (
+    ("idx_image_tag_tag", "image_tag (tag, image_id)"),
+    ("idx_image_use_case_use_case", "image_use_case (use_case, image_id)"),
+    ("idx_image_color_lab_bin", "image_color (lab_bin, image_id)"),
+    ("idx_image_color_hex", "image_color (hex)"),
+)
+
+def _create_facet_indexes(conn):
+    for name, definition in FACET_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+def _create_facet_tables(conn):
+    """
+    Creates the normalized tag / use case / colour tables and the indexes
+    used for facet filtering, filling them from existing images the first
+    time they are created.
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_images_image_type ON images (image_type)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_images_style_name ON images (style_name)")
+    is_new = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_tag'"
+    ).fetchone() is None
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS image_tag (
+        image_id TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        PRIMARY KEY (image_id, tag)
+    ) WITHOUT ROWID
     """)
-    conn.commit()
-    conn.close()
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS image_use_case (
+        image_id TEXT NOT NULL,
+        use_case TEXT NOT NULL,
+        PRIMARY KEY (image_id, use_case)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS image_color (
+        image_id TEXT NOT NULL,
+        hex TEXT NOT NULL,
+        lab_l REAL NOT NULL,
+        lab_a REAL NOT NULL,
+        lab_b REAL NOT NULL,
+        lab_bin TEXT NOT NULL,
+        PRIMARY KEY (image_id, hex)
+    ) WITHOUT ROWID
+    """)
+    _create_facet_indexes(conn)
+    if is_new:
+        rows = conn.execute("SELECT * FROM images").fetchall()
+        _sync_facets(conn, [dict(row) for row in rows])
+        _bump_generation(conn)
+
+def _sync_facets(conn, records, replace=True):
+    """
+    Replaces the tag, use case and colour rows of each record's image.
+    replace=False skips deleting existing rows, for images known to be new.
+    """
+    # Like INSERT OR REPLACE on images, the last record for an image_id wins
+    records = list({data.get("image_id"): data for data in records}.values())
+    if replace:
+        image_ids = [(data.get("image_id"),) for data in records]
+        for table in ("image_tag", "image_use_case", "image_color"):
+            conn.executemany(f"DELETE FROM {table} WHERE image_id = ?", image_ids)
+    conn.executemany("INSERT INTO image_tag (image_id, tag) VALUES (?, ?)", [
+        (data.get("image_id"), tag)
+        for data in records for tag in facets.split_list(data.get("emotional_keyword_tags"))
+    ])
+    conn.executemany("INSERT INTO image_use_case (image_id, use_case) VALUES (?, ?)", [
+        (data.get("image_id"), use_case)
+        for data in records for use_case in facets.split_list(data.get("recommended_use_cases"))
+    ])
+    conn.executemany("INSERT INTO image_color (image_id, hex, lab_l, lab_a, lab_b, lab_bin) VALUES (?, ?, ?, ?, ?, ?)", [
+        (data.get("image_id"),) + color
+        for data in records for color in facets.color_rows(data.get("color_palette"))
+    ])
+
+def _create_search_index(conn):
+    """
+    Creates the FTS5 index over the images text fields and the triggers that
+    keep it in sync. The index is rebuilt from the images table when it is
+    first created. Does nothing if this SQLite build lacks FTS5; search then
+    falls back to LIKE scans.
+    """
+    if _has_search_index(conn):
+        return
+    try:
+        conn.execute(f"""
+        CREATE VIRTUAL TABLE images_fts USING fts5(
+            {", ".join(FTS_COLUMNS)},
+            content='images', content_rowid='rowid',
+            tokenize='porter unicode61', prefix='2 3'
+        )
+        """)
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e):
+            raise
+        return
+    for trigger_sql in _search_triggers().values():
+        conn.execute(trigger_sql)
+    conn.execute("INSERT INTO images_fts(images_fts) VALUES ('rebuild')")
+    _bump_generation(conn)
+
+def _search_triggers():
+    """The CREATE TRIGGER statements that keep images_fts in sync, by trigger name."""
+    columns = ", ".join(FTS_COLUMNS)
+    new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    return {
+        "images_fts_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+            INSERT INTO images_fts(rowid, {columns}) VALUES (new.rowid, {new_values});
+        END
+        """,
+        "images_fts_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+            INSERT INTO images_fts(images_fts, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});
+        END
+        """,
+        "images_fts_update": f"""
+        CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE ON images BEGIN
+            INSERT INTO images_fts(images_fts, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});
+            INSERT INTO images_fts(rowid, {columns}) VALUES (new.rowid, {new_values});
+        END
+        """,
+    }
+
+def _has_search_index(conn):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'"
+    ).fetchone()
+    return row is not None
+
+# --- Read Cache ---
+def _bump_generation(conn):
+    """Marks the catalog as changed; call inside every write transaction touching images."""
+    conn.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = 'generation'")
+
+def get_catalog_generation():
+    """Returns the catalog's change counter (shared by all processes using the database)."""
+    with connection() as conn:
+        try:
+            row = _with_retry(lambda: conn.execute("SELECT value FROM catalog_meta WHERE key = 'generation'").fetchone())
+        except sqlite3.OperationalError as e:
+            # Database from before the read cache; create_table() adds the table
+            if "no such table" not in str(e):
+                raise
+            return 0
+        return row[0] if row else 0
+
+def _cached_read(func):
+    """
+    Serves repeated calls from the process-wide read cache until the catalog
+    generation changes. Callers get copies, so modifying a result is safe.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not os.path.exists(DB_PATH):
+            return func(*args, **kwargs)
+        generation = (DB_PATH, get_catalog_generation())
+        key = (func.__name__, catalog_cache.freeze(args), catalog_cache.freeze(kwargs))
+        return _read_cache.get_or_compute(generation, key, lambda: func(*args, **kwargs))
+    return wrapper
+
+def get_read_cache_stats():
+    """Returns hit/miss counts, hit rate, entry count and approximate bytes held by the read cache."""
+    return _read_cache.stats()
+
+def clear_read_cache():
+    """Empties this process's read cache, e.g. to time uncached queries."""
+    _read_cache.clear()
+
+_INSERT_IMAGE_SQL = """
+INSERT OR REPLACE INTO images (
+    image_id, image_path, image_thumbnail, image_type, style_name,
+    composition_structure, color_palette, lighting, texture_finish,
+    geometry_flow, primary_emotional_tone, emotional_keyword_tags,
+    narrative_metaphor, ai_generation_prompt, recreation_guidelines,
+    recommended_use_cases, prompt_version
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _record_values(data):
+    return tuple(data.get(column) for column in IMAGE_COLUMNS)
 
 def insert_image_record(data):
-    """Inserts a new image record into the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    INSERT OR REPLACE INTO images (
-        image_id, image_path, image_thumbnail, image_type, style_name,
-        composition_structure, color_palette, lighting, texture_finish,
-        geometry_flow, primary_emotional_tone, emotional_keyword_tags,
-        narrative_metaphor, ai_generation_prompt, recreation_guidelines,
-        recommended_use_cases
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, tuple(data.values()))
-    conn.commit()
-    conn.close()
+    """Inserts a new image record into the database, along with its facet rows."""
+    with metrics.span("db_insert"), transaction() as conn:
+        conn.execute(_INSERT_IMAGE_SQL, _record_values(data))
+        _sync_facets(conn, [data])
+        _bump_generation(conn)
+
+def insert_image_records(records):
+    """Inserts many image records and their facet rows in a single transaction."""
+    with metrics.span("db_insert"), transaction() as conn:
+        conn.executemany(_INSERT_IMAGE_SQL, [_record_values(data) for data in records])
+        _sync_facets(conn, records)
+        _bump_generation(conn)
+
+def import_image_rows(chunks):
+    """
+    Bulk-inserts chunks of image rows (tuples in IMAGE_COLUMNS order, with
+    unique image_ids) and their facet rows in a single transaction; a failure
+    in any chunk rolls back the whole import. Returns the number of rows.
+
+    Updating the search index row by row through its triggers is several
+    times slower than indexing in one statement, so the insert and delete
+    triggers are dropped for the duration of the transaction. Afterwards the
+    new rows are indexed with one INSERT ... SELECT, or, if the import
+    replaced existing rows, the whole index is rebuilt. The facet tables'
+    secondary indexes are likewise dropped and built once at the end, and
+    facet rows are only deleted for chunks that replaced existing images.
+    """
+    count = replaced = 0
+    with metrics.span("db_insert"), transaction() as conn:
+        has_search_index = _has_search_index(conn)
+        if has_search_index:
+            triggers = _search_triggers()
+            for name in ("images_fts_insert", "images_fts_delete"):
+                conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for name, _ in FACET_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        # New and replaced rows all get rowids above the current maximum
+        last_rowid, existing = conn.execute("SELECT COALESCE(MAX(rowid), 0), COUNT(*) FROM images").fetchone()
+        for chunk in chunks:
+            conn.executemany(_INSERT_IMAGE_SQL, chunk)
+            count += len(chunk)
+            total = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            chunk_replaced = existing + count - replaced - total
+            replaced += chunk_replaced
+            _sync_facets(conn, [dict(zip(IMAGE_COLUMNS, row)) for row in chunk], replace=chunk_replaced > 0)
+        _create_facet_indexes(conn)
+        if has_search_index:
+            # Merging segments while indexing everything at once only slows
+            # it down; later writes merge them as usual (4 is FTS5's default)
+            conn.execute("INSERT INTO images_fts(images_fts, rank) VALUES ('automerge', 0)")
+            if replaced:
+                conn.execute("INSERT INTO images_fts(images_fts) VALUES ('rebuild')")
+            else:
+                columns = ", ".join(FTS_COLUMNS)
+                conn.execute(
+                    f"INSERT INTO images_fts(rowid, {columns}) SELECT rowid, {columns} FROM images WHERE rowid > ?",
+                    (last_rowid,),
+                )
+            conn.execute("INSERT INTO images_fts(images_fts, rank) VALUES ('automerge', 4)")
+            conn.execute(triggers["images_fts_insert"])
+            conn.execute(triggers["images_fts_delete"])
+        _bump_generation(conn)
+    return count
+
+def iter_image_rows(chunk_size=1000, columns=IMAGE_COLUMNS):
+    """
+    Yields every image row as lists of up to chunk_size tuples, ordered by
+    image_id. A single statement streams the table, so the whole export sees
+    one consistent snapshot without loading the table into memory.
+    """
+    # A connection of its own rather than the thread's: the generator may be
+    # suspended between other database calls, or finished on another thread
+    path, conn = _acquire()
+    try:
+        cursor = _with_retry(conn.execute, f"SELECT {_select_list(columns)} FROM images ORDER BY image_id")
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield [tuple(row) for row in rows]
+        finally:
+            cursor.close()
+    finally:
+        _release(path, conn)
+
+def get_image_table_columns():
+    """Returns the images table's columns as they exist in the database."""
+    with connection() as conn:
+        return tuple(row["name"] for row in _with_retry(lambda: conn.execute("PRAGMA table_info(images)").fetchall()))
+
+def find_image_by_path(image_path):
+    """Returns the image_id of a record for the original at image_path, or None."""
+    if not os.path.exists(DB_PATH):
+        return None
+    with connection() as conn:
+        row = _with_retry(lambda: conn.execute(
+            "SELECT image_id FROM images WHERE image_path = ? LIMIT 1", (image_path,)
+        ).fetchone())
+        return row["image_id"] if row else None
+
+def update_image_thumbnail(image_id, thumb_path):
+    """Points an image record at a new thumbnail file."""
+    with transaction() as conn:
+        conn.execute("UPDATE images SET image_thumbnail = ? WHERE image_id = ?", (thumb_path, image_id))
+        _bump_generation(conn)
 
 def get_all_images():
     """Retrieves all image records as a Pandas DataFrame."""
+    # pandas takes about half a second to import, so only load it when needed
+    import pandas as pd
+
     if not os.path.exists(DB_PATH):
         return pd.DataFrame() # Return empty dataframe if DB doesn't exist
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query("SELECT * FROM images ORDER BY image_id DESC", conn)
-    conn.close()
-    return df
+    with connection() as conn:
+        return _with_retry(pd.read_sql_query, "SELECT * FROM images ORDER BY image_id DESC", conn)
+
+def get_cached_analysis(content_hash, prompt_version, model):
+    """Returns the cached analysis dict for an image's content, or None."""
+    if not os.path.exists(DB_PATH):
+        return None
+    with connection() as conn:
+        row = _with_retry(lambda: conn.execute(
+            "SELECT result_json FROM analysis_cache WHERE content_hash = ? AND prompt_version = ? AND model = ?",
+            (content_hash, prompt_version, model),
+        ).fetchone())
+        return json.loads(row["result_json"]) if row else None
+
+def save_cached_analysis(content_hash, prompt_version, model, result):
+    """Stores a parsed analysis dict for an image's content."""
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO analysis_cache VALUES (?, ?, ?, ?, ?)",
+            (content_hash, prompt_version, model, json.dumps(result), time.time()),
+        )
+
+def enqueue_analysis_job(image_path, image_thumbnail=None, max_attempts=JOB_MAX_ATTEMPTS):
+    """Queues an image for background analysis and returns the job id."""
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO analysis_jobs (image_path, image_thumbnail, max_attempts, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (image_path, image_thumbnail, max_attempts, now, now, now),
+        )
+        return cursor.lastrowid
+
+def claim_analysis_job():
+    """
+    Marks the oldest runnable job as running and returns it, or None if there
+    is nothing to do. Runnable means queued and due, or running with an
+    expired lease. A job whose lease expired on its last attempt is marked
+    failed instead: it most likely took its worker down (e.g. out of memory),
+    and handing it out again would do the same forever.
+    """
+    now = time.time()
+    with transaction() as conn:
+        conn.execute("""
+        UPDATE analysis_jobs
+        SET status = 'failed', error = 'Worker stopped during the last attempt', updated_at = ?
+        WHERE status = 'running' AND updated_at <= ? AND attempts >= max_attempts
+        """, (now, now - JOB_LEASE_SECONDS))
+        row = conn.execute("""
+        SELECT * FROM analysis_jobs
+        WHERE (status = 'queued' AND available_at <= ?)
+           OR (status = 'running' AND updated_at <= ?)
+        ORDER BY available_at, job_id
+        LIMIT 1
+        """, (now, now - JOB_LEASE_SECONDS)).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE analysis_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+            (now, row["job_id"]),
+        )
+    job = _job_dict(row)
+    job["status"] = "running"
+    job["attempts"] += 1
+    return job
+
+def complete_analysis_job(job_id, result, debug_info):
+    """Stores a finished job's analysis result."""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE analysis_jobs SET status = 'done', result_json = ?, debug_json = ?, error = NULL, updated_at = ? "
+            "WHERE job_id = ?",
+            (json.dumps(result), json.dumps(debug_info), time.time(), job_id),
+        )
+
+def fail_analysis_job(job_id, error, debug_info, retry_delay):
+    """
+    Records a failed attempt. The job is queued again after retry_delay
+    seconds, or marked failed if it has no attempts left.
+    """
+    now = time.time()
+    with transaction() as conn:
+        conn.execute("""
+        UPDATE analysis_jobs
+        SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+            error = ?, debug_json = ?, available_at = ?, updated_at = ?
+        WHERE job_id = ?
+        """, (error, json.dumps(debug_info), now + retry_delay, now, job_id))
+
+def get_analysis_job(job_id):
+    """Returns a job as a dict with its result and debug info decoded, or None."""
+    if not os.path.exists(DB_PATH):
+        return None
+    with connection() as conn:
+        row = _with_retry(lambda: conn.execute("SELECT * FROM analysis_jobs WHERE job_id = ?", (job_id,)).fetchone())
+        return _job_dict(row) if row else None
+
+def _job_dict(row):
+    job = dict(row)
+    result_json, debug_json = job.pop("result_json"), job.pop("debug_json")
+    job["result"] = json.loads(result_json) if result_json else None
+    job["debug_info"] = json.loads(debug_json) if debug_json else []
+    return job
+
+def get_stale_images(prompt_version, limit=None, include_manual=False):
+    """
+    Returns (image_id, image_path) for images analyzed with a prompt other
+    than prompt_version (or before versions were tracked), skipping images
+    already waiting in an unapplied batch. Manually entered records are only
+    included with include_manual=True.
+    """
+    if not os.path.exists(DB_PATH):
+        return []
+    sql = """
+    SELECT image_id, image_path FROM images
+    WHERE (prompt_version IS NULL OR prompt_version != ?)
+      AND image_id NOT IN (
+        SELECT items.image_id FROM analysis_batch_items AS items
+        JOIN analysis_batches AS batches ON batches.batch_id = items.batch_id
+        WHERE batches.applied_at IS NULL
+      )
+    """
+    params = [prompt_version]
+    if not include_manual:
+        sql += " AND prompt_version IS NOT ?"
+        params.append(MANUAL_PROMPT_VERSION)
+    sql += " ORDER BY image_id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    with connection() as conn:
+        rows = _with_retry(lambda: conn.execute(sql, params).fetchall())
+        return [tuple(row) for row in rows]
+
+def save_analysis_batch(batch_id, input_file_id, prompt_version, model, status, items):
+    """Records a submitted batch and its (image_id, image_path, content_hash) items."""
+    now = time.time()
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO analysis_batches (batch_id, input_file_id, prompt_version, model, status, "
+            "request_count, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (batch_id, input_file_id, prompt_version, model, status, len(items), now, now),
+        )
+        conn.executemany(
+            "INSERT INTO analysis_batch_items (batch_id, image_id, image_path, content_hash) VALUES (?, ?, ?, ?)",
+            [(batch_id,) + tuple(item) for item in items],
+        )
+
+def update_analysis_batch(batch_id, status, output_file_id=None, error_file_id=None):
+    """Stores a batch's latest status and result file ids."""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE analysis_batches SET status = ?, output_file_id = ?, error_file_id = ?, updated_at = ? "
+            "WHERE batch_id = ?",
+            (status, output_file_id, error_file_id, time.time(), batch_id),
+        )
+
+def get_analysis_batches(unapplied_only=False):
+    """Returns batches as dicts, oldest first."""
+    if not os.path.exists(DB_PATH):
+        return []
+    sql = "SELECT * FROM analysis_batches"
+    if unapplied_only:
+        sql += " WHERE applied_at IS NULL"
+    with connection() as conn:
+        rows = _with_retry(lambda: conn.execute(sql + " ORDER BY created_at, batch_id").fetchall())
+        return [dict(row) for row in rows]
+
+def get_analysis_batch_items(batch_id):
+    """Returns {image_id: (image_path, content_hash)} for a batch's requests."""
+    with connection() as conn:
+        rows = _with_retry(lambda: conn.execute(
+            "SELECT image_id, image_path, content_hash FROM analysis_batch_items WHERE batch_id = ?", (batch_id,)
+        ).fetchall())
+        return {row["image_id"]: (row["image_path"], row["content_hash"]) for row in rows}
+
+def get_image_records(image_ids):
+    """Returns full image records (dicts keyed by IMAGE_COLUMNS) for the given ids, in order."""
+    return _get_images_by_ids(list(image_ids), IMAGE_COLUMNS)
+
+def apply_analysis_batch(batch_id, records):
+    """
+    Writes a finished batch's re-analyzed records and marks the batch applied,
+    in one transaction, so a batch is never applied twice.
+    """
+    now = time.time()
+    with transaction() as conn:
+        if records:
+            insert_image_records(records)
+        conn.execute(
+            "UPDATE analysis_batches SET applied_at = ?, updated_at = ? WHERE batch_id = ?", (now, now, batch_id)
+        )
+
+def save_image_features(rows):
+    """Stores (image_id, dhash, histogram) feature rows for similarity search."""
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO image_features (image_id, dhash, histogram) VALUES (?, ?, ?)",
+            [(image_id, dhash, histogram.astype("float32").tobytes()) for image_id, dhash, histogram in rows],
+        )
 
+def get_features_version():
+    """Changes whenever feature rows are added, replaced or removed."""
+    if not os.path.exists(DB_PATH):
+        return None
+    with connection() as conn:
+        count, max_rowid = _with_retry(lambda: conn.execute(
+            "SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM image_features"
+        ).fetchone())
+        return f"{count}-{max_rowid}"
+
+def load_image_features():
+    """Returns (version, rows) with every (image_id, dhash, histogram_bytes) feature row."""
+    version = get_features_version()
+    if version is None:
+        return None, []
+    with connection() as conn:
+        rows = _with_retry(lambda: conn.execute("SELECT image_id, dhash, histogram FROM image_features").fetchall())
+        return version, [tuple(row) for row in rows]
+
+def get_images_missing_features():
+    """Returns (image_id, image_path) for catalog images with no stored features."""
+    if not os.path.exists(DB_PATH):
+        return []
+    with connection() as conn:
+        rows = _with_retry(lambda: conn.execute("""
+        SELECT images.image_id, images.image_path FROM images
+        LEFT JOIN image_features ON image_features.image_id = images.image_id
+        WHERE image_features.image_id IS NULL
+        """).fetchall())
+        return [tuple(row) for row in rows]
+
+def _get_images_by_ids(image_ids, columns):
+    """Returns row dicts for the given ids, in the same order."""
+    if not image_ids:
+        return []
+    placeholders = ", ".join("?" for _ in image_ids)
+    with connection() as conn:
+        rows = _with_retry(lambda: conn.execute(
+            f"SELECT {_select_list(columns)} FROM images WHERE image_id IN ({placeholders})", list(image_ids)
+        ).fetchall())
+        by_id = {row["image_id"]: dict(row) for row in rows}
+        return [by_id[image_id] for image_id in image_ids if image_id in by_id]
+
+def find_similar(image_id, k=6, columns=GRID_COLUMNS):
+    """
+    Returns up to k catalog images that look most like image_id, most
+    similar first. Each row dict has a 'similarity' score (1.0 = identical).
+    Returns [] if the image has no stored features.
+    """
+    from src import similarity_index
+
+    index = similarity_index.get_index()
+    features = index.features_for(image_id)
+    if features is None:
+        return []
+    matches = index.query(*features, k=k, exclude=image_id)
+    rows = _get_images_by_ids([match_id for match_id, _, _ in matches], columns)
+    scores = {match_id: score for match_id, score, _ in matches}
+    for row in rows:
+        row["similarity"] = scores[row["image_id"]]
+    return rows
+
+def find_near_duplicates(image, max_distance=None, columns=GRID_COLUMNS):
+    """
+    Returns catalog images whose perceptual hash is within max_distance bits
+    of image (a file path or an open binary file, such as an upload not yet
+    saved), closest first, each with a 'hash_distance'. Used to warn about
+    re-uploads of the same picture.
+    """
+    from src import image_features, similarity_index
+
+    dhash, _ = image_features.compute_features(image)
+    if max_distance is None:
+        max_distance = similarity_index.NEAR_DUPLICATE_DISTANCE
+    matches = similarity_index.get_index().near_duplicates(dhash, max_distance)
+    rows = _get_images_by_ids([match_id for match_id, _ in matches], columns)
+    distances = dict(matches)
+    for row in rows:
+        row["hash_distance"] = distances[row["image_id"]]
+    return rows
+
+def _select_list(columns, table=None):
+    """Validates requested columns against the schema and builds a SELECT list."""
+    unknown = [c for c in columns if c not in IMAGE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown image columns: {', '.join(unknown)}")
+    if "image_id" not in columns:
+        columns = ("image_id",) + tuple(columns)
+    if table:
+        columns = [f"{table}.{c}" for c in columns]
+    return ", ".join(columns)
+
+# Side table and column behind each multi-valued facet
+_SIDE_TABLE_FACETS = {
+    "tag": ("image_tag", "tag"),
+    "use_case": ("image_use_case", "use_case"),
+    "color": ("image_color", "lab_bin"),
+}
+
+def _color_bin(hex_color):
+    """The lab bin a HEX colour filter value matches."""
+    colors = facets.parse_hex_colors(hex_color)
+    # Exactly one #RGB or #RRGGBB code and nothing else
+    if len(colors) != 1 or len(hex_color.strip()) not in (4, 7):
+        raise ValueError(f"Invalid colour: {hex_color}")
+    return facets.lab_bin(facets.hex_to_lab(colors[0]))
+
+def _filter_clause(filters, table="images"):
+    """
+    Builds a WHERE condition for facet filters: {facet: [values]}. Values of
+    one facet are alternatives (OR); different facets must all match (AND).
+    Colour values may be lab bins or HEX codes, which match their bin.
+    Returns (sql, params); sql is empty when there is nothing to filter.
+    """
+    conditions, params = [], []
+    for facet, values in (filters or {}).items():
+        if facet not in facets.FACETS:
+            raise ValueError(f"Unknown facet: {facet}")
+        if not values:
+            continue
+        values = list(values)
+        if facet == "color":
+            values = [_color_bin(v) if v.startswith("#") else v for v in values]
+        placeholders = ", ".join("?" for _ in values)
+        if facet in _SIDE_TABLE_FACETS:
+            side_table, column = _SIDE_TABLE_FACETS[facet]
+            conditions.append(f"{table}.image_id IN (SELECT image_id FROM {side_table} WHERE {column} IN ({placeholders}))")
+        else:
+            conditions.append(f"{table}.{facet} IN ({placeholders})")
+        params.extend(values)
+    return " AND ".join(conditions), params
+
+@_cached_read
+def get_facet_counts(filters=None, limit=20):
+    """
+    Returns {facet: [{'value', 'count'}, ...]} with the most common values of
+    each facet among images matching filters. Each facet is counted without
+    its own filter, so its other values stay selectable. Colour entries also
+    carry a sample 'hex' from their bin.
+    """
+    if not os.path.exists(DB_PATH):
+        return {facet: [] for facet in facets.FACETS}
+    with connection() as conn:
+        counts = {}
+        for facet in facets.FACETS:
+            other_filters = {f: v for f, v in (filters or {}).items() if f != facet}
+            clause, params = _filter_clause(other_filters)
+            if facet in _SIDE_TABLE_FACETS:
+                side_table, column = _SIDE_TABLE_FACETS[facet]
+                extra = ", MIN(hex)" if facet == "color" else ""
+                where = f"WHERE image_id IN (SELECT image_id FROM images WHERE {clause})" if clause else ""
+                sql = f"""
+                SELECT {column}, COUNT(DISTINCT image_id) AS n{extra} FROM {side_table} {where}
+                GROUP BY {column} ORDER BY n DESC, {column} LIMIT ?
+                """
+            else:
+                where = f"AND {clause}" if clause else ""
+                sql = f"""
+                SELECT {facet}, COUNT(*) AS n FROM images WHERE {facet} IS NOT NULL AND {facet} != '' {where}
+                GROUP BY {facet} ORDER BY n DESC, {facet} LIMIT ?
+                """
+            rows = _with_retry(lambda: conn.execute(sql, params + [limit]).fetchall())
+            counts[facet] = [
+                dict({"value": row[0], "count": row[1]}, **({"hex": row[2]} if facet == "color" else {}))
+                for row in rows
+            ]
+        return counts
+
+@_cached_read
+def get_images_page(columns=GRID_COLUMNS, after_id=None, limit=DEFAULT_PAGE_SIZE, filters=None):
+    """
+    Retrieves one page of the catalog, newest image_id first.
+    Uses keyset pagination: pass the returned cursor as after_id to get the
+    next page. Returns (rows, next_cursor); next_cursor is None on the last page.
+    filters restricts the page to matching facet values (see _filter_clause).
+    """
+    if not os.path.exists(DB_PATH):
+        return [], None
+    sql = f"SELECT {_select_list(columns)} FROM images"
+    clause, params = _filter_clause(filters)
+    conditions = [clause] if clause else []
+    if after_id is not None:
+        conditions.append("image_id < ?")
+        params.append(after_id)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    # Fetch one extra row to learn whether another page exists
+    sql += " ORDER BY image_id DESC LIMIT ?"
+    params.append(limit + 1)
+    with connection() as conn:
+        rows = _with_retry(lambda: conn.execute(sql, params).fetchall())
+        rows = [dict(row) for row in rows]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]["image_id"]
+        return rows, next_cursor
+
+@_cached_read
+def count_images(filters=None):
+    """Returns the number of images in the catalog, or matching filters."""
+    if not os.path.exists(DB_PATH):
+        return 0
+    clause, params = _filter_clause(filters)
+    sql = "SELECT COUNT(*) FROM images" + (f" WHERE {clause}" if clause else "")
+    with connection() as conn:
+        return _with_retry(lambda: conn.execute(sql, params).fetchone()[0])
+
+@_cached_read
 def get_image_details(image_id):
     """Retrieves detailed information for a specific image."""
     if not os.path.exists(DB_PATH):
         return None
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM images WHERE image_id = ?", (image_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result 
\ No newline at end of file
+    with connection() as conn:
+        return _with_retry(lambda: conn.execute("SELECT * FROM images WHERE image_id = ?", (image_id,)).fetchone())
+
+def _search_terms(query):
+    """Splits free text into lowercase word terms."""
+    return re.findall(r"\w+", query.lower())
+
+def _fts_match_expression(terms):
+    """Builds an FTS5 MATCH expression: every term must match, as a prefix."""
+    return " ".join(f'"{term}"*' for term in terms)
+
+def _like_search_clause(terms):
+    """Builds the LIKE fallback used when FTS5 is unavailable."""
+    fields = " || ' ' || ".join(f"COALESCE({c}, '')" for c in FTS_COLUMNS)
+    clause = " AND ".join(f"({fields}) LIKE ?" for _ in terms)
+    return clause, [f"%{term}%" for term in terms]
+
+@_cached_read
+def search_images(query, limit=DEFAULT_PAGE_SIZE, offset=0, columns=GRID_COLUMNS, filters=None):
+    """
+    Full-text search over the generated metadata, best matches first.
+    Every word in the query must match (as a prefix) somewhere in the text
+    fields. filters restricts results to matching facet values. Returns a
+    list of row dicts with the requested columns.
+    """
+    terms = _search_terms(query)
+    if not terms or not os.path.exists(DB_PATH):
+        return []
+    with connection() as conn:
+        filter_sql, filter_params = _filter_clause(filters)
+        filter_sql = f"AND {filter_sql}" if filter_sql else ""
+        if _has_search_index(conn):
+            sql = f"""
+            SELECT {_select_list(columns, table="images")}
+            FROM images_fts JOIN images ON images.rowid = images_fts.rowid
+            WHERE images_fts MATCH ? {filter_sql}
+            ORDER BY images_fts.rank
+            LIMIT ? OFFSET ?
+            """
+            params = [_fts_match_expression(terms)] + filter_params + [limit, offset]
+        else:
+            clause, params = _like_search_clause(terms)
+            sql = f"""
+            SELECT {_select_list(columns)} FROM images
+            WHERE {clause} {filter_sql}
+            ORDER BY image_id DESC
+            LIMIT ? OFFSET ?
+            """
+            params += filter_params + [limit, offset]
+        rows = _with_retry(lambda: conn.execute(sql, params).fetchall())
+        return [dict(row) for row in rows]
+
+@_cached_read
+def count_search_results(query, filters=None):
+    """Returns how many images match a search_images() query."""
+    terms = _search_terms(query)
+    if not terms or not os.path.exists(DB_PATH):
+        return 0
+    with connection() as conn:
+        filter_sql, filter_params = _filter_clause(filters)
+        if _has_search_index(conn):
+            if filter_sql:
+                sql = f"""
+                SELECT COUNT(*) FROM images_fts JOIN images ON images.rowid = images_fts.rowid
+                WHERE images_fts MATCH ? AND {filter_sql}
+                """
+            else:
+                sql = "SELECT COUNT(*) FROM images_fts WHERE images_fts MATCH ?"
+            params = [_fts_match_expression(terms)] + filter_params
+        else:
+            clause, params = _like_search_clause(terms)
+            sql = f"SELECT COUNT(*) FROM images WHERE {clause}" + (f" AND {filter_sql}" if filter_sql else "")
+            params += filter_params
+        return _with_retry(lambda: conn.execute(sql, params).fetchone()[0])
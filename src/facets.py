@@ -0,0 +1,88 @@
+"""
+Parsing of the free-text metadata fields into facet values.
+
+The model returns tags, use cases and colour palettes as free text; these
+helpers turn them into the normalized values stored in the image_tag,
+image_use_case and image_color side tables.
+"""
+import functools
+import math
+import re
+
+# Facet names accepted by db_manager's filter and facet-count functions
+FACETS = ("image_type", "style_name", "tag", "use_case", "color")
+
+# Quantization steps for CIELAB colour bins: L* is 0-100, a*/b* roughly -128-127
+LAB_L_STEP = 25
+LAB_AB_STEP = 40
+
+_LIST_SEPARATORS = re.compile(r"[,;\n]+")
+_HEX_COLOR = re.compile(r"#([0-9a-fA-F]{6}|[0-9a-fA-F]{3})(?![0-9a-fA-F])")
+_EMPTY_VALUES = {"", "n/a", "na", "none"}
+
+
+def split_list(text):
+    """Splits a comma-separated field into unique, lowercase values, keeping their order."""
+    values = []
+    for part in _LIST_SEPARATORS.split(text or ""):
+        value = part.strip().strip(".'\"").strip().lower()
+        if value not in _EMPTY_VALUES and value not in values:
+            values.append(value)
+    return values
+
+
+def parse_hex_colors(text):
+    """Returns the unique HEX colours in a palette description as #RRGGBB."""
+    colors = []
+    for match in _HEX_COLOR.finditer(text or ""):
+        digits = match.group(1).upper()
+        if len(digits) == 3:
+            digits = "".join(c * 2 for c in digits)
+        color = f"#{digits}"
+        if color not in colors:
+            colors.append(color)
+    return colors
+
+
+def _linear(channel):
+    return channel / 12.92 if channel <= 0.04045 else ((channel + 0.055) / 1.055) ** 2.4
+
+
+# Linear-light value of each 8-bit sRGB channel value
+_LINEAR = tuple(_linear(value / 255) for value in range(256))
+
+
+def hex_to_lab(hex_color):
+    """Converts #RRGGBB (sRGB, D65) to CIELAB (L*, a*, b*)."""
+    value = int(hex_color[1:7], 16)
+    r, g, b = _LINEAR[value >> 16], _LINEAR[(value >> 8) & 0xFF], _LINEAR[value & 0xFF]
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+
+    def f(t):
+        return t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+
+    fx, fy, fz = f(x), f(y), f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def lab_bin(lab):
+    """Quantizes a CIELAB colour into a coarse bin id such as '2:-1:1'."""
+    l, a, b = lab
+    # a*/b* bins are centred on 0 so neutral greys share one bin
+    a_bin = math.floor(a / LAB_AB_STEP + 0.5)
+    b_bin = math.floor(b / LAB_AB_STEP + 0.5)
+    return f"{min(max(int(l // LAB_L_STEP), 0), 100 // LAB_L_STEP - 1)}:{a_bin}:{b_bin}"
+
+
+@functools.lru_cache(maxsize=65536)
+def _color_row(color):
+    # Palettes repeat a lot across a catalog, so bulk imports convert each colour once
+    lab = hex_to_lab(color)
+    return (color,) + tuple(round(v, 2) for v in lab) + (lab_bin(lab),)
+
+
+def color_rows(palette_text):
+    """Returns (hex, L*, a*, b*, lab_bin) for each HEX colour in a palette description."""
+    return [_color_row(color) for color in parse_hex_colors(palette_text)]
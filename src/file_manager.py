@@ -1,5 +1,8 @@
+import hashlib
 import os
-from PIL import Image
+import tempfile
+from PIL import Image, ImageOps, features
+from src import metrics
 
 # This path points to the persistent volume inside the container
 UPLOAD_DIR = "/app/data/uploads/"
@@ -10,19 +13,163 @@ def setup_directories():
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     os.makedirs(THUMBNAIL_DIR, exist_ok=True)
 
+# Rendition sizes (longest side in px), smallest first. The smallest one is
+# stored in the image_thumbnail column.
+RENDITION_SIZES = (128, 512, 1024)
+RENDITION_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+RENDITION_EXTENSION = ".webp" if RENDITION_FORMAT == "WEBP" else ".jpg"
+RENDITION_QUALITY = 80
+
+# Read size used when hashing and copying files
+CHUNK_SIZE = 1024 * 1024
+
+def hash_file(path):
+    """Returns the SHA-256 hex digest of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def content_name(content_hash, original_name):
+    """Content-addressed file name: the hash plus the original extension."""
+    extension = os.path.splitext(original_name)[1].lower()
+    return f"{content_hash}{extension}"
+
+def _is_up_to_date(derived_path, source_path):
+    """True if derived_path exists and is no older than source_path."""
+    try:
+        return os.path.getmtime(derived_path) >= os.path.getmtime(source_path)
+    except OSError:
+        return False
+
+def rendition_path(image_path, size):
+    """Where the rendition of an original at the given size is stored."""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(THUMBNAIL_DIR, str(size), f"{stem}{RENDITION_EXTENSION}")
+
+def _prepare_for_encoding(img):
+    """Converts to a mode the rendition format can store."""
+    if RENDITION_FORMAT == "WEBP":
+        keep_alpha = img.mode in ("RGBA", "LA") or "transparency" in img.info
+        return img.convert("RGBA" if keep_alpha else "RGB")
+    return img.convert("RGB")
+
+def create_renditions(file_path, force=False):
+    """
+    Creates the resized renditions of an original, skipping any that are
+    already up to date unless force is set. The original is decoded once;
+    each smaller size is derived from the next larger one. Returns {size: path}.
+    """
+    paths = {size: rendition_path(file_path, size) for size in RENDITION_SIZES}
+    missing = [size for size, path in paths.items() if force or not _is_up_to_date(path, file_path)]
+    if not missing:
+        return paths
+
+    with Image.open(file_path) as img:
+        largest = max(missing)
+        # Lets the JPEG decoder scale down by up to 8x while decoding
+        img.draft("RGB", (largest, largest))
+        # Renditions carry no EXIF, so camera rotation has to be applied to the pixels
+        img = ImageOps.exif_transpose(img)
+        img = _prepare_for_encoding(img)
+        for size in sorted(missing, reverse=True):
+            img.thumbnail((size, size))
+            os.makedirs(os.path.dirname(paths[size]), exist_ok=True)
+            _write_atomically(paths[size], lambda f: img.save(f, RENDITION_FORMAT, quality=RENDITION_QUALITY))
+    return paths
+
+def get_rendition(image_path, width):
+    """
+    Returns the smallest existing rendition at least width px wide, the
+    largest rendition if none is, or the original if no renditions exist yet.
+    """
+    fallback = image_path
+    for size in RENDITION_SIZES:
+        path = rendition_path(image_path, size)
+        if os.path.exists(path):
+            fallback = path
+            if size >= width:
+                return path
+    return fallback
+
+def _write_atomically(file_path, write):
+    """Writes via a temporary file so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def _stream_to_content_path(source, original_name):
+    """
+    Copies a readable binary stream into UPLOAD_DIR in CHUNK_SIZE pieces,
+    hashing as it goes, and returns the content-addressed path. Only one
+    chunk is held in memory at a time.
+    """
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        file_path = os.path.join(UPLOAD_DIR, content_name(digest.hexdigest(), original_name))
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, file_path)
+        return file_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 def save_uploaded_file(uploaded_file):
-    """Saves the uploaded file and creates a thumbnail."""
+    """
+    Saves the uploaded file and creates a thumbnail.
+    Files are stored under their SHA-256 hash, so identical bytes are written
+    once whatever their name, and different images never overwrite each other.
+    """
     setup_directories()
     
-    # Save original file
-    file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # Save original file, streamed in chunks
+    uploaded_file.seek(0)
+    with metrics.span("file_save"):
+        file_path = _stream_to_content_path(uploaded_file, uploaded_file.name)
 
-    # Create and save thumbnail
-    thumb_path = os.path.join(THUMBNAIL_DIR, uploaded_file.name)
-    with Image.open(file_path) as img:
-        img.thumbnail((128, 128))
-        img.save(thumb_path)
+    # Create and save thumbnail renditions
+    with metrics.span("thumbnail"):
+        thumb_path = create_renditions(file_path)[RENDITION_SIZES[0]]
         
-    return file_path, thumb_path 
\ No newline at end of file
+    return file_path, thumb_path
+
+def persist_upload(uploaded_file, store):
+    """
+    Saves an upload at most once per session and returns (file_path, thumb_path).
+    store is a dict kept in the Streamlit session state. It remembers the
+    content-addressed paths for each upload (by Streamlit's file_id), so
+    reruns skip hashing, writing and thumbnailing entirely.
+    """
+    key = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+    paths = store.get(key)
+    if paths and all(os.path.exists(path) for path in paths):
+        return paths
+    paths = save_uploaded_file(uploaded_file)
+    store[key] = paths
+    return paths
+
+def save_local_file(source_path):
+    """Copies an image from the local filesystem into the catalog and creates a thumbnail."""
+    setup_directories()
+
+    with metrics.span("file_save"), open(source_path, "rb") as source:
+        file_path = _stream_to_content_path(source, source_path)
+
+    with metrics.span("thumbnail"):
+        thumb_path = create_renditions(file_path)[RENDITION_SIZES[0]]
+
+    return file_path, thumb_path
@@ -0,0 +1,89 @@
+"""
+Locally computed visual features used for similarity search.
+
+Each image gets a 64-bit difference hash (dHash), which is robust to
+resizing and re-encoding and so catches near-duplicates, and a 64-bin RGB
+colour histogram for "looks like this" ranking. Both come from one small
+decode of the image with Pillow/NumPy; no API calls are involved.
+
+Usage (compute features for catalog rows that don't have them yet):
+    python -m src.image_features
+"""
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+# Bins per RGB channel; the histogram has HISTOGRAM_BINS ** 3 entries
+HISTOGRAM_BINS = 4
+HISTOGRAM_SAMPLE_SIZE = 64
+
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit; store hashes in that range."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def dhash(img):
+    """64-bit difference hash: compares horizontally adjacent pixels of a 9x8 grayscale thumbnail."""
+    pixels = np.asarray(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return _to_signed(int("".join("1" if bit else "0" for bit in bits), 2))
+
+
+def colour_histogram(img):
+    """
+    Normalized RGB histogram as float32. Stores square roots of the bin
+    frequencies, so the dot product of two histograms is their
+    Bhattacharyya coefficient (1.0 for identical colour distributions).
+    """
+    rgb = np.asarray(img.convert("RGB").resize((HISTOGRAM_SAMPLE_SIZE, HISTOGRAM_SAMPLE_SIZE)), dtype=np.uint16)
+    quantized = rgb * HISTOGRAM_BINS // 256
+    bins = (quantized[..., 0] * HISTOGRAM_BINS + quantized[..., 1]) * HISTOGRAM_BINS + quantized[..., 2]
+    counts = np.bincount(bins.ravel(), minlength=HISTOGRAM_BINS ** 3).astype(np.float32)
+    return np.sqrt(counts / counts.sum())
+
+
+def compute_features(image_path):
+    """Returns (dhash, histogram) for an image file path or open binary file."""
+    with Image.open(image_path) as img:
+        # Decode JPEGs at reduced scale; the features only need a few pixels
+        img.draft("RGB", (HISTOGRAM_SAMPLE_SIZE * 2, HISTOGRAM_SAMPLE_SIZE * 2))
+        return dhash(img), colour_histogram(img)
+
+
+def backfill_features():
+    """Computes features for catalog images that don't have them. Returns (added, skipped)."""
+    from src import db_manager
+
+    added = skipped = 0
+    for image_id, image_path in db_manager.get_images_missing_features():
+        if not image_path or not os.path.exists(image_path):
+            skipped += 1
+            continue
+        try:
+            features = compute_features(image_path)
+        except OSError as e:
+            logger.warning(f"Skipping {image_id}: {e}")
+            skipped += 1
+            continue
+        db_manager.save_image_features([(image_id,) + features])
+        added += 1
+    return added, skipped
+
+
+def main():
+    from src import db_manager
+
+    logging.basicConfig(level=logging.INFO)
+    db_manager.create_table()
+    added, skipped = backfill_features()
+    print(f"Computed features for {added} images, {skipped} skipped")
+
+
+if __name__ == "__main__":
+    main()
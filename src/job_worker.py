@@ -0,0 +1,109 @@
+"""
+Background worker for the analysis job queue.
+
+The dashboard queues an analysis job per image instead of calling the API
+on the Streamlit thread; this worker claims jobs from the analysis_jobs
+table, runs them, and stores the result or error. Failed attempts are
+retried with exponential backoff (or the API's Retry-After on rate limits).
+
+Usage:
+    python -m src.job_worker --workers 2
+"""
+import argparse
+import logging
+import threading
+import time
+import traceback
+
+from src import batch_analyzer, db_manager, metrics, vision_analyzer
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 300.0
+
+
+def _retry_delay(error, attempts):
+    """Seconds to wait before a failed job's next attempt."""
+    if batch_analyzer.is_rate_limited(error):
+        server_delay = batch_analyzer.retry_after(error)
+        if server_delay:
+            return server_delay
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+
+def process_next_job():
+    """Claims and runs one job. Returns False if the queue had nothing runnable."""
+    job = db_manager.claim_analysis_job()
+    if job is None:
+        return False
+
+    job_id = job["job_id"]
+    debug_info = [f"⚙️ Job {job_id}, attempt {job['attempts']} of {job['max_attempts']}"]
+    logger.info(f"Running analysis job {job_id} for {job['image_path']}")
+    try:
+        result = vision_analyzer.analyze_image(job["image_path"], debug_info)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        debug_info.append(f"❌ OpenAI API error: {error}")
+        debug_info.append(f"Full traceback: {traceback.format_exc()}")
+        delay = _retry_delay(e, job["attempts"])
+        logger.error(f"Analysis job {job_id} failed: {error}")
+        db_manager.fail_analysis_job(job_id, error, debug_info, delay)
+    else:
+        db_manager.complete_analysis_job(job_id, result, debug_info)
+        logger.info(f"Analysis job {job_id} done")
+    return True
+
+
+def run_worker(poll_interval=POLL_INTERVAL, stop_event=None, drain=False):
+    """
+    Processes jobs until stop_event is set. With drain=True, returns as soon
+    as no job is runnable instead of polling.
+    """
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            if process_next_job():
+                continue
+        except Exception as e:
+            # Database trouble shouldn't kill the worker; try again next poll
+            logger.error(f"Job worker error: {type(e).__name__}: {e}")
+        # Queue is empty: publish the latest job metrics before idling
+        metrics.flush_pending()
+        if drain:
+            return
+        stop_event.wait(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background image analysis jobs.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of jobs to run concurrently")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help="Seconds to wait when the queue is empty")
+    parser.add_argument("--drain", action="store_true", help="Exit once the queue is empty")
+    args = parser.parse_args()
+
+    db_manager.create_table()
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=run_worker, args=(args.poll_interval, stop_event, args.drain),
+                         name=f"job-worker-{i}")
+        for i in range(args.workers)
+    ]
+    for thread in threads:
+        thread.start()
+    logger.info(f"Job worker started with {args.workers} thread(s)")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        logger.info("Stopping job worker...")
+        stop_event.set()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Per-stage latency and token-usage metrics.
+
+Code paths time their stages with span("stage"), which records into a
+histogram labelled by stage; token usage from API responses goes into
+counters. Each process keeps its metrics in memory and periodically writes
+a JSON snapshot to METRICS_DIR. The snapshots of all processes (dashboard,
+job worker, batch runs) are merged into METRICS_DIR/metrics.prom in the
+Prometheus text format, ready for node_exporter's textfile collector, and
+shown on the dashboard's Metrics page.
+
+Usage (print the merged metrics):
+    python -m src.metrics
+"""
+import atexit
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv("METRICS_DIR", "/app/data/metrics")
+PROMETHEUS_FILE = "metrics.prom"
+# Minimum seconds between automatic snapshot writes
+FLUSH_INTERVAL = 10.0
+# Snapshots from processes that stopped longer ago than this are deleted
+SNAPSHOT_MAX_AGE = 7 * 24 * 3600
+
+# Stage latencies range from under a millisecond (parsing) to tens of seconds (API calls)
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 5000, 10000)
+
+# Pipeline stages in processing order
+STAGES = ("file_save", "thumbnail", "encode", "api_request", "parse", "db_insert")
+
+# USD per million tokens, for cost estimates (gpt-4o list prices by default)
+INPUT_PRICE_PER_MILLION = float(os.getenv("OPENAI_INPUT_PRICE_PER_MILLION", "2.50"))
+OUTPUT_PRICE_PER_MILLION = float(os.getenv("OPENAI_OUTPUT_PRICE_PER_MILLION", "10.00"))
+# Batch API requests are billed at this share of the list prices
+BATCH_PRICE_FACTOR = 0.5
+
+STAGE_DURATION = "catalog_stage_duration_seconds"
+STAGE_ERRORS = "catalog_stage_errors_total"
+API_TOKENS = "catalog_openai_tokens_total"
+API_REQUEST_TOKENS = "catalog_openai_request_tokens"
+PARSE_FALLBACKS = "catalog_parse_fallbacks_total"
+BATCH_TOKENS = "catalog_openai_batch_tokens_total"
+
+HELP = {
+    STAGE_DURATION: ("histogram", "Time spent in each processing stage."),
+    STAGE_ERRORS: ("counter", "Stage executions that raised an exception."),
+    API_TOKENS: ("counter", "Tokens used by OpenAI API responses, by type."),
+    API_REQUEST_TOKENS: ("histogram", "Tokens used per OpenAI API request, by type."),
+    PARSE_FALLBACKS: ("counter", "Responses that weren't valid JSON and fell back to raw text."),
+    BATCH_TOKENS: ("counter", "Tokens used by OpenAI Batch API responses, by type."),
+}
+
+_process_name = f"{socket.gethostname()}-{os.getpid()}"
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+# True when there are values not yet written to this process's snapshot
+_dirty = False
+
+
+def _mark_dirty():
+    global _dirty
+    _dirty = True
+
+
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def observe(name, value, labels=None, buckets=DURATION_BUCKETS):
+    """Records one value in a histogram."""
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        if histogram is None:
+            histogram = _histograms[_key(name, labels)] = {
+                "buckets": list(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0,
+            }
+        for i, bound in enumerate(histogram["buckets"]):
+            if value <= bound:
+                histogram["counts"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+        _mark_dirty()
+    _maybe_flush()
+
+
+def increment(name, amount=1, labels=None):
+    """Adds to a counter."""
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+        _mark_dirty()
+    _maybe_flush()
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block as one execution of stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        increment(STAGE_ERRORS, labels={"stage": stage})
+        raise
+    finally:
+        observe(STAGE_DURATION, time.perf_counter() - start, {"stage": stage})
+
+
+def record_token_usage(usage, batch=False):
+    """
+    Records the usage block of a chat-completions response (an object, a
+    dict as found in Batch API output files, or None). Batch usage is counted
+    separately since it is billed at a discount.
+    """
+    if usage is None:
+        return
+    for token_type in ("prompt", "completion"):
+        if isinstance(usage, dict):
+            tokens = usage.get(f"{token_type}_tokens")
+        else:
+            tokens = getattr(usage, f"{token_type}_tokens", None)
+        if tokens is None:
+            continue
+        if batch:
+            increment(BATCH_TOKENS, tokens, {"type": token_type})
+        else:
+            increment(API_TOKENS, tokens, {"type": token_type})
+            observe(API_REQUEST_TOKENS, tokens, {"type": token_type}, TOKEN_BUCKETS)
+
+
+# --- Snapshots ---
+
+def snapshot():
+    """This process's metrics as a JSON-serializable dict."""
+    with _lock:
+        return {
+            "process": _process_name,
+            "updated": time.time(),
+            "histograms": [
+                {
+                    "name": name, "labels": dict(labels), "buckets": list(histogram["buckets"]),
+                    "counts": list(histogram["counts"]), "sum": histogram["sum"], "count": histogram["count"],
+                }
+                for (name, labels), histogram in _histograms.items()
+            ],
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in _counters.items()
+            ],
+        }
+
+
+def merge_snapshots(snapshots):
+    """Sums histograms and counters across process snapshots."""
+    histograms, counters = {}, {}
+    for snap in snapshots:
+        for entry in snap.get("histograms", []):
+            key = _key(entry["name"], entry["labels"])
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = merged = {
+                    "name": entry["name"], "labels": entry["labels"], "buckets": entry["buckets"],
+                    "counts": [0] * len(entry["buckets"]), "sum": 0.0, "count": 0,
+                }
+            elif merged["buckets"] != entry["buckets"]:
+                continue  # bucket layout changed between versions; keep the first seen
+            merged["counts"] = [a + b for a, b in zip(merged["counts"], entry["counts"])]
+            merged["sum"] += entry["sum"]
+            merged["count"] += entry["count"]
+        for entry in snap.get("counters", []):
+            key = _key(entry["name"], entry["labels"])
+            if key not in counters:
+                counters[key] = {"name": entry["name"], "labels": entry["labels"], "value": 0}
+            counters[key]["value"] += entry["value"]
+    return {"histograms": list(histograms.values()), "counters": list(counters.values())}
+
+
+def quantile(histogram, q):
+    """
+    Estimates the q-quantile of a histogram by linear interpolation within
+    its bucket, like Prometheus' histogram_quantile(). None if empty.
+    """
+    if not histogram["count"]:
+        return None
+    rank = q * histogram["count"]
+    seen, lower = 0, 0.0
+    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+        if count and seen + count >= rank:
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    # In the +Inf bucket: the best estimate is the largest finite bound
+    return histogram["buckets"][-1]
+
+
+def estimated_cost(prompt_tokens, completion_tokens, batch=False):
+    """API cost in USD for a number of tokens."""
+    cost = (prompt_tokens * INPUT_PRICE_PER_MILLION + completion_tokens * OUTPUT_PRICE_PER_MILLION) / 1e6
+    return cost * BATCH_PRICE_FACTOR if batch else cost
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def render_prometheus(merged):
+    """Renders merged metrics in the Prometheus text exposition format."""
+    lines = []
+    by_name = {}
+    for entry in merged["histograms"] + merged["counters"]:
+        by_name.setdefault(entry["name"], []).append(entry)
+    for name in sorted(by_name):
+        metric_type, help_text = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for entry in sorted(by_name[name], key=lambda e: sorted(e["labels"].items())):
+            labels = entry["labels"]
+            if "buckets" not in entry:
+                lines.append(f"{name}{_format_labels(labels)} {entry['value']}")
+                continue
+            cumulative = 0
+            for bound, count in zip(entry["buckets"], entry["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {entry['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {entry['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {entry['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomically(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_snapshots(metrics_dir=None):
+    """Reads every process snapshot in metrics_dir, deleting ones too old to keep."""
+    metrics_dir = metrics_dir or METRICS_DIR
+    snapshots = []
+    if not os.path.isdir(metrics_dir):
+        return snapshots
+    now = time.time()
+    for name in os.listdir(metrics_dir):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(metrics_dir, name)
+        try:
+            with open(path) as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if now - snap.get("updated", now) > SNAPSHOT_MAX_AGE:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        snapshots.append(snap)
+    return snapshots
+
+
+def flush(metrics_dir=None):
+    """
+    Writes this process's snapshot and regenerates the merged Prometheus
+    file. Errors are swallowed: metrics must never break the pipeline.
+    """
+    global _last_flush, _dirty
+    metrics_dir = metrics_dir or METRICS_DIR
+    _last_flush = time.monotonic()
+    _dirty = False
+    try:
+        os.makedirs(metrics_dir, exist_ok=True)
+        _write_atomically(os.path.join(metrics_dir, f"{_process_name}.json"), json.dumps(snapshot()))
+        merged = merge_snapshots(load_snapshots(metrics_dir))
+        _write_atomically(os.path.join(metrics_dir, PROMETHEUS_FILE), render_prometheus(merged))
+    except OSError:
+        pass
+
+
+def flush_pending():
+    """Flushes if anything was recorded since the last flush, e.g. when a worker goes idle."""
+    if _dirty:
+        flush()
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+atexit.register(flush_pending)
+
+
+def current_metrics(metrics_dir=None):
+    """
+    Merged metrics of all processes, with this process's live values in
+    place of its last written snapshot.
+    """
+    others = [snap for snap in load_snapshots(metrics_dir) if snap.get("process") != _process_name]
+    return merge_snapshots(others + [snapshot()])
+
+
+def main():
+    print(render_prometheus(current_metrics()), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+In-memory nearest-neighbour index over the image_features table.
+
+The whole catalog's hashes and histograms are held in two NumPy arrays and
+searched by brute force, which is a few milliseconds at 100k images. The
+index is loaded once per process and reloaded only when the feature table
+changes. If SIMILARITY_MMAP_DIR is set, the arrays are also written there
+as .npy files and memory-mapped, so several processes share one copy.
+"""
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+
+from src import db_manager
+
+# Share of the similarity score given to the perceptual hash; the rest
+# comes from the colour histogram
+HASH_WEIGHT = 0.5
+# Hashes this many bits apart or fewer are treated as the same picture
+NEAR_DUPLICATE_DISTANCE = 6
+
+MMAP_DIR = os.getenv("SIMILARITY_MMAP_DIR")
+# Older versions' files are deleted once they are this old, so a process
+# that has just found one still has time to map it
+MMAP_GRACE_SECONDS = 60.0
+
+# Set bits per byte value, for vectorized popcount
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(hashes, query_hash):
+    """Bit differences between query_hash and each entry of a uint64 array."""
+    xor = np.bitwise_xor(hashes, np.uint64(query_hash & 0xFFFFFFFFFFFFFFFF))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int32)
+
+
+class SimilarityIndex:
+    """Feature arrays for the catalog, aligned with a list of image ids."""
+
+    def __init__(self, image_ids, hashes, histograms):
+        self.image_ids = image_ids
+        self.hashes = hashes
+        self.histograms = histograms
+        self._positions = {image_id: i for i, image_id in enumerate(image_ids)}
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def features_for(self, image_id):
+        """Returns (hash, histogram) for an indexed image, or None."""
+        position = self._positions.get(image_id)
+        if position is None:
+            return None
+        return int(self.hashes[position]), self.histograms[position]
+
+    def query(self, query_hash, histogram, k, exclude=None):
+        """
+        Returns up to k (image_id, score, hash_distance) tuples, most similar
+        first. score is 1.0 for identical features.
+        """
+        if not len(self):
+            return []
+        distances = hamming_distances(self.hashes, query_hash)
+        scores = HASH_WEIGHT * (1.0 - distances / 64.0) + (1.0 - HASH_WEIGHT) * (self.histograms @ histogram)
+        if exclude is not None and exclude in self._positions:
+            scores[self._positions[exclude]] = -np.inf
+        k = min(k, len(self))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self.image_ids[i], float(scores[i]), int(distances[i]))
+            for i in top if np.isfinite(scores[i])
+        ]
+
+    def near_duplicates(self, query_hash, max_distance=NEAR_DUPLICATE_DISTANCE):
+        """Returns (image_id, hash_distance) for every image within max_distance bits, closest first."""
+        if not len(self):
+            return []
+        distances = hamming_distances(self.hashes, query_hash)
+        matches = np.flatnonzero(distances <= max_distance)
+        matches = matches[np.argsort(distances[matches])]
+        return [(self.image_ids[i], int(distances[i])) for i in matches]
+
+
+def _memory_map(version, hashes, histograms):
+    """Writes the arrays to MMAP_DIR (once per version) and reopens them memory-mapped."""
+    os.makedirs(MMAP_DIR, exist_ok=True)
+    arrays = {}
+    for name, array in (("hashes", hashes), ("histograms", histograms)):
+        path = os.path.join(MMAP_DIR, f"{name}-{version}.npy")
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+        arrays[name] = np.load(path, mmap_mode="r")
+    _remove_old_versions(version)
+    return arrays["hashes"], arrays["histograms"]
+
+
+def _remove_old_versions(version):
+    """
+    Deletes array files of other versions, and temporary files of crashed
+    writers, written more than MMAP_GRACE_SECONDS ago. Processes that still map one keep their mapping
+    (on Windows, where mapped files can't be deleted, they are left for later).
+    """
+    current = {os.path.join(MMAP_DIR, f"{name}-{version}.npy") for name in ("hashes", "histograms")}
+    cutoff = time.time() - MMAP_GRACE_SECONDS
+    paths = glob.glob(os.path.join(MMAP_DIR, "hashes-*.npy")) + glob.glob(os.path.join(MMAP_DIR, "histograms-*.npy"))
+    for path in paths:
+        if path in current:
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def build_index():
+    """Loads every stored feature vector into a new SimilarityIndex."""
+    version, rows = db_manager.load_image_features()
+    image_ids = [row[0] for row in rows]
+    hashes = np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64)
+    histograms = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.float32)
+    histograms = histograms.reshape(len(rows), -1) if rows else histograms.reshape(0, 0)
+    if MMAP_DIR and rows:
+        hashes, histograms = _memory_map(version, hashes, histograms)
+    return version, SimilarityIndex(image_ids, hashes, histograms)
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Returns the process-wide index, reloading it if the feature table changed."""
+    global _index, _index_version
+    version = db_manager.get_features_version()
+    with _index_lock:
+        if _index is None or version != _index_version:
+            _index_version, _index = build_index()
+        return _index
@@ -0,0 +1,108 @@
+"""
+Import-time report for the modules the dashboard loads at startup.
+
+Runs a fresh interpreter with `python -X importtime`, so the numbers match a
+container cold start, and prints the slowest imports by cumulative time.
+It exits non-zero when a module that should be imported lazily (openai,
+pandas) is loaded at startup or, with --budget-ms, when the median total
+import time is over budget, so it can be used as a regression check in CI.
+
+Usage:
+    python -m src.startup_report
+    python -m src.startup_report --runs 5 --budget-ms 400
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# The project modules dashboard.py imports at startup
+DASHBOARD_MODULES = (
+    "src.batch_analyzer", "src.db_manager", "src.file_manager",
+    "src.image_features", "src.vision_analyzer",
+)
+# Heavy packages that must only be imported on first use
+LAZY_MODULES = ("openai", "pandas")
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_imports(modules=DASHBOARD_MODULES):
+    """
+    Imports modules in a new interpreter with -X importtime. Returns a list
+    of (module, self_us, cumulative_us, depth) in import order.
+    """
+    code = "; ".join(f"import {module}" for module in modules)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+    )
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "| imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def total_ms(entries, modules=DASHBOARD_MODULES):
+    """
+    Total import time of modules: the cumulative times of their top-level
+    entries, leaving out interpreter startup (site, encodings).
+    """
+    roots = {module.split(".")[0] for module in modules} | set(modules)
+    return sum(
+        cumulative for name, _, cumulative, depth in entries if depth == 0 and name in roots
+    ) / 1000
+
+
+def lazy_violations(entries, lazy_modules=LAZY_MODULES):
+    """Returns the lazy-only packages that were imported."""
+    imported = {name.split(".")[0] for name, _, _, _ in entries}
+    return [module for module in lazy_modules if module in imported]
+
+
+def format_report(entries, top=15):
+    lines = [f"{'cumulative ms':>14} {'self ms':>9}  module"]
+    for name, self_us, cumulative_us, depth in sorted(entries, key=lambda e: -e[2])[:top]:
+        lines.append(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * depth}{name}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import time of the dashboard's startup modules.")
+    parser.add_argument("modules", nargs="*", default=list(DASHBOARD_MODULES), help="Modules to import")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to measure; the median is used")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, help="Exit with status 1 if the median total exceeds this")
+    args = parser.parse_args()
+
+    runs = [measure_imports(args.modules) for _ in range(max(1, args.runs))]
+    totals = [total_ms(entries, args.modules) for entries in runs]
+    median = statistics.median(totals)
+    # Show the breakdown of the run closest to the median
+    entries = min(runs, key=lambda e: abs(total_ms(e, args.modules) - median))
+
+    print(format_report(entries, args.top))
+    print(f"\nTotal import time: {median:.1f} ms (median of {len(totals)} runs: "
+          f"{', '.join(f'{t:.1f}' for t in totals)})")
+
+    failures = []
+    violations = lazy_violations(entries)
+    if violations:
+        failures.append(f"imported at startup but should be lazy: {', '.join(violations)}")
+    if args.budget_ms is not None and median > args.budget_ms:
+        failures.append(f"{median:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
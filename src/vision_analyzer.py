@@ -1,44 +1,214 @@
 import base64
+import hashlib
+import io
 import json
-import openai
-from src import config
+import mmap
+from src import config, db_manager, file_manager, metrics
 import logging
 import os
-import httpx  # Make sure httpx is imported
+import threading
+from PIL import Image, ImageOps
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds per API attempt, and retries by the client. All attempts together
+# (3 x 80s plus backoff) stay under db_manager.JOB_LEASE_SECONDS, so a slow
+# call can't outlive its job lease and be claimed by a second worker.
+API_TIMEOUT = 80.0
+API_MAX_RETRIES = 2
+
 # Global variable to store initialization status
 client = None
 init_error = None
+_client_lock = threading.Lock()
 
-# --- Simplified and Corrected OpenAI Client Initialization ---
-try:
-    api_key = config.get_openai_api_key()
-    logger.info("Initializing OpenAI client...")
-    
-    # Explicitly create an httpx client, disabling environment proxies to prevent errors.
-    http_client = httpx.Client(proxies="")
-    
-    # Initialize the OpenAI client with the API key and the custom http_client.
-    client = openai.OpenAI(
-        api_key=api_key,
-        http_client=http_client
-    )
-    
-    logger.info("OpenAI client initialized successfully.")
-except Exception as e:
-    init_error = str(e)
-    logger.error(f"Error initializing OpenAI client: {e}")
-    client = None
+# --- Lazy OpenAI Client Initialization ---
+def get_client():
+    """
+    Returns the shared OpenAI client, creating it on first use so importing
+    this module doesn't load the openai package or read the environment.
+    Returns None if initialization failed; init_error holds the reason.
+    """
+    global client, init_error
+    if client is not None:
+        return client
+    with _client_lock:
+        if client is not None:
+            return client
+        try:
+            import httpx
+            import openai
+
+            api_key = config.get_openai_api_key()
+            logger.info("Initializing OpenAI client...")
+            
+            # Explicitly create an httpx client, disabling environment proxies to prevent errors.
+            http_client = httpx.Client(proxies="")
+            
+            # Initialize the OpenAI client with the API key and the custom http_client.
+            # base_url is None unless OPENAI_BASE_URL points at a stub/proxy.
+            client = openai.OpenAI(
+                api_key=api_key,
+                base_url=config.get_openai_base_url(),
+                http_client=http_client,
+                timeout=API_TIMEOUT,
+                max_retries=API_MAX_RETRIES
+            )
+            init_error = None
+            logger.info("OpenAI client initialized successfully.")
+        except Exception as e:
+            init_error = str(e)
+            logger.error(f"Error initializing OpenAI client: {e}")
+        return client
 # --- End of Initialization Block ---
 
-def encode_image(image_path):
-    """Encodes a local image file into a base64 string."""
+MODEL = "gpt-4o"
+
+# --- Image Preprocessing ---
+# GPT-4o fits high-detail images within 2048x2048 and then scales the short
+# side down to 768px, so anything larger only costs upload time.
+MAX_LONG_SIDE = int(os.getenv("ANALYSIS_MAX_LONG_SIDE", "2048"))
+MAX_SHORT_SIDE = int(os.getenv("ANALYSIS_MAX_SHORT_SIDE", "768"))
+# Format and quality used when an image has to be re-encoded
+ENCODE_FORMAT = os.getenv("ANALYSIS_IMAGE_FORMAT", "JPEG").upper()
+ENCODE_QUALITY = int(os.getenv("ANALYSIS_IMAGE_QUALITY", "85"))
+# "low", "high", or "auto" to use low detail for images that fit in one tile
+DETAIL = os.getenv("ANALYSIS_DETAIL", "high")
+LOW_DETAIL_MAX_SIDE = 512
+
+# Bytes sent versus original file sizes, for this process
+_encode_stats = {"calls": 0, "original_bytes": 0, "sent_bytes": 0}
+_encode_stats_lock = threading.Lock()
+
+def _target_size(width, height):
+    """Largest size within the model's effective resolution, never upscaling."""
+    long_side, short_side = max(width, height), min(width, height)
+    scale = min(1.0, MAX_LONG_SIDE / long_side, MAX_SHORT_SIDE / short_side)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def _choose_detail(size):
+    if DETAIL != "auto":
+        return DETAIL
+    return "low" if max(size) <= LOW_DETAIL_MAX_SIDE else "high"
+
+# EXIF orientation tag, and the orientations that swap width and height
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+def _orientation(img):
+    return img.getexif().get(EXIF_ORIENTATION, 1)
+
+def _upright_size(img):
+    """The image's size as displayed, after its EXIF rotation."""
+    width, height = img.size
+    return (height, width) if _orientation(img) in TRANSPOSED_ORIENTATIONS else (width, height)
+
+def _reencode(img, size):
+    """
+    Rotates an opened image upright per its EXIF orientation, resizes it to
+    size (upright dimensions) and re-encodes it in ENCODE_FORMAT. The output
+    has no EXIF, so the rotation must be in the pixels. Returns a buffer view.
+    """
+    # Lets the JPEG decoder scale down while decoding (draft works on the stored, unrotated image)
+    img.draft("RGB", size[::-1] if _orientation(img) in TRANSPOSED_ORIENTATIONS else size)
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGBA")
+        if ENCODE_FORMAT == "JPEG":
+            # JPEG has no alpha; flatten transparent areas onto white
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, ENCODE_FORMAT, quality=ENCODE_QUALITY)
+    # A view of the buffer, not a copy of it
+    return buffer.getbuffer()
+
+def prepare_image(image_path):
+    """
+    Prepares an image for the API: rotates it upright per its EXIF
+    orientation, downscales it to the model's effective resolution and
+    re-encodes it when that is needed or makes it smaller.
+    Returns (image_data, mime_type, detail, original_size_in_bytes), where
+    image_data is None when the original file should be sent unchanged.
+    """
+    original_bytes = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        original_format = img.format
+        upright_size = _upright_size(img)
+        size = _target_size(*upright_size)
+        needs_resize = size != upright_size
+        # A rotated original can't be sent as is; the model may not honour EXIF
+        needs_rotation = _orientation(img) != 1
+        data = None
+        if needs_resize or needs_rotation or original_format != ENCODE_FORMAT:
+            data = _reencode(img, size)
+    # Keep the original file when it is already small enough, upright, and re-encoding didn't help
+    if data is None or (not needs_resize and not needs_rotation and len(data) >= original_bytes):
+        data = None
+        mime_type = Image.MIME.get(original_format, "image/jpeg")
+    else:
+        mime_type = Image.MIME[ENCODE_FORMAT]
+
+    with _encode_stats_lock:
+        _encode_stats["calls"] += 1
+        _encode_stats["original_bytes"] += original_bytes
+        _encode_stats["sent_bytes"] += original_bytes if data is None else len(data)
+    return data, mime_type, _choose_detail(size), original_bytes
+
+# Raw bytes base64-encoded per step; a multiple of 3 so chunks join cleanly
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+
+def build_data_url(mime_type, source):
+    """
+    Base64-encodes a bytes-like source (bytes, memoryview or mmap) into a
+    data: URL. The encoded text is written in chunks into one preallocated
+    buffer, so the only full-size allocations are that buffer and the final
+    string.
+    """
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    with memoryview(source) as view:
+        buffer = bytearray(len(prefix) + 4 * ((len(view) + 2) // 3))
+        buffer[:len(prefix)] = prefix
+        offset = len(prefix)
+        for start in range(0, len(view), ENCODE_CHUNK_SIZE):
+            chunk = base64.b64encode(view[start:start + ENCODE_CHUNK_SIZE])
+            buffer[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+    return buffer.decode("ascii")
+
+def encode_image_data_url(image_path):
+    """
+    Prepares an image and encodes it as a data: URL for the API.
+    Returns (data_url, mime_type, detail, original_bytes, sent_bytes).
+
+    Originals sent unchanged are memory-mapped rather than read into memory.
+    For S bytes sent, peak memory per in-flight image is therefore about
+    2 x 4/3 x S while the URL is built (buffer + string), then about
+    3 x 4/3 x S while the client serializes the request (URL + JSON text +
+    encoded body). S is bounded by the resize above: at most a
+    2048x768 re-encode, or an original already within that size. Decoding
+    for the resize adds width x height x 4 bytes; JPEGs are decoded at
+    reduced scale via draft mode, other formats at full size.
+    """
+    data, mime_type, detail, original_bytes = prepare_image(image_path)
+    if data is not None:
+        return build_data_url(mime_type, data), mime_type, detail, original_bytes, len(data)
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return build_data_url(mime_type, mapped), mime_type, detail, original_bytes, original_bytes
+
+def get_encode_stats():
+    """Returns how many image bytes preprocessing has saved in this process."""
+    with _encode_stats_lock:
+        stats = dict(_encode_stats)
+    stats["bytes_saved"] = stats["original_bytes"] - stats["sent_bytes"]
+    stats["bytes_saved_per_call"] = stats["bytes_saved"] / stats["calls"] if stats["calls"] else 0
+    return stats
 
 def get_system_prompt():
     """Returns the detailed system prompt instructing the AI."""
@@ -64,6 +234,200 @@ def get_system_prompt():
     }
     """
 
+# Identifies the prompt text; cached analyses from another prompt are not reused
+PROMPT_VERSION = hashlib.sha256(get_system_prompt().encode("utf-8")).hexdigest()[:12]
+
+# --- Request Template ---
+# Everything in a chat-completions request except the image is the same for
+# every call, so it is built once here instead of per request.
+_SYSTEM_MESSAGE = {"role": "system", "content": get_system_prompt()}
+_USER_TEXT_PART = {"type": "text", "text": "Please analyze this image and provide the JSON output."}
+_REQUEST_TEMPLATE = {
+    "model": MODEL,
+    "response_format": {"type": "json_object"},
+    "temperature": 0.7,
+    "max_tokens": 2000,
+}
+
+def build_request(data_url, detail):
+    """Returns the chat-completions arguments for one encoded image."""
+    request = dict(_REQUEST_TEMPLATE)
+    request["messages"] = [
+        _SYSTEM_MESSAGE,
+        {
+            "role": "user",
+            "content": [
+                _USER_TEXT_PART,
+                {"type": "image_url", "image_url": {"url": data_url, "detail": detail}},
+            ],
+        },
+    ]
+    return request
+
+# Analysis cache counters for this process
+_cache_stats = {"hits": 0, "misses": 0}
+_cache_stats_lock = threading.Lock()
+
+def encode_for_request(image_path, debug_info):
+    """Encodes an image and returns the chat-completions arguments for it."""
+    debug_info.append(f"🔍 Encoding image: {image_path}")
+    logger.info(f"Encoding image: {image_path}")
+    with metrics.span("encode"):
+        data_url, mime_type, detail, original_bytes, sent_bytes = encode_image_data_url(image_path)
+    debug_info.append(
+        f"✅ Image encoded successfully, size: {len(data_url)} characters "
+        f"({mime_type}, {detail} detail, {original_bytes - sent_bytes} bytes saved)"
+    )
+    logger.info(f"Image encoded successfully, size: {len(data_url)} characters, {original_bytes - sent_bytes} bytes saved")
+    return build_request(data_url, detail)
+
+def response_content(response, debug_info):
+    """Extracts the message text from a chat-completions response."""
+    debug_info.append("✅ API call successful, parsing response...")
+    logger.info("API call successful, parsing response...")
+    metrics.record_token_usage(getattr(response, "usage", None))
+    content = response.choices[0].message.content
+    debug_info.append(f"📄 Raw response preview: {content[:200]}...")
+    logger.info(f"Raw response: {content[:200]}...")
+    return content
+
+def request_analysis(image_path, debug_info):
+    """
+    Sends one image to the vision model and returns the raw response text.
+    API errors (including rate limits) propagate to the caller.
+    """
+    openai_client = get_client()
+    if not openai_client:
+        raise RuntimeError(f"OpenAI client not initialized. Init error: {init_error}")
+
+    request = encode_for_request(image_path, debug_info)
+    
+    debug_info.append("🚀 Making OpenAI API call...")
+    logger.info("Making OpenAI API call...")
+    
+    try:
+        with metrics.span("api_request"):
+            response = openai_client.chat.completions.create(**request)
+    except Exception as api_error:
+        debug_info.append(f"❌ API call failed: {api_error}")
+        raise api_error
+    
+    return response_content(response, debug_info)
+
+def _parse_json_content(content, debug_info):
+    """Parses the response as JSON, or extracts an embedded JSON object. Returns None if neither works."""
+    # Try to parse JSON from the response
+    try:
+        analysis_dict = json.loads(content)
+        debug_info.append("🎉 JSON parsed successfully")
+        logger.info("JSON parsed successfully")
+        return analysis_dict
+    except json.JSONDecodeError:
+        # If it's not valid JSON, try to extract JSON from the text
+        import re
+        json_match = re.search(r'\{.*\}', content, re.DOTALL)
+        if json_match:
+            try:
+                analysis_dict = json.loads(json_match.group())
+                debug_info.append("🎉 JSON extracted and parsed successfully")
+                logger.info("JSON extracted and parsed successfully")
+                return analysis_dict
+            except:
+                pass
+        return None
+
+def _fallback_analysis(content, image_path, debug_info):
+    """Builds a manual structure holding the raw response text."""
+    debug_info.append("⚠️ Could not parse JSON, creating manual structure")
+    return {
+        'image_id': f"IMG-{os.path.basename(image_path).split('.')[0]}",
+        'image_type': 'Real Photograph',
+        'style_name': 'AI Analysis Result',
+        'composition_structure': content[:200] + "...",
+        'color_palette': 'Unable to analyze',
+        'lighting': 'Unable to analyze',
+        'texture_finish': 'Unable to analyze',
+        'geometry_flow': 'Unable to analyze',
+        'primary_emotional_tone': 'Unable to analyze',
+        'emotional_keyword_tags': 'ai-generated, analysis',
+        'narrative_metaphor': content,
+        'ai_generation_prompt': 'N/A',
+        'recreation_guidelines': 'See narrative section for AI response',
+        'recommended_use_cases': 'General use',
+        # Not a real analysis: the record stays stale, so backfills retry it
+        'prompt_version': None
+    }
+
+def _record_cache_lookup(hit):
+    with _cache_stats_lock:
+        _cache_stats["hits" if hit else "misses"] += 1
+
+def get_cache_stats():
+    """Returns analysis cache hit/miss counters for this process."""
+    with _cache_stats_lock:
+        hits, misses = _cache_stats["hits"], _cache_stats["misses"]
+    lookups = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / lookups if lookups else 0.0}
+
+def lookup_cached_analysis(image_path, debug_info):
+    """
+    Hashes an image and looks up a cached analysis of its content.
+    Returns (content_hash, analysis_dict or None).
+    """
+    content_hash = file_manager.hash_file(image_path)
+    cached = db_manager.get_cached_analysis(content_hash, PROMPT_VERSION, MODEL)
+    _record_cache_lookup(cached is not None)
+    if cached is not None:
+        # Entries cached before analyses carried their version
+        cached["prompt_version"] = PROMPT_VERSION
+        debug_info.append(f"♻️ Using cached analysis for content {content_hash[:12]}")
+        logger.info(f"Analysis cache hit for {content_hash[:12]}")
+    return content_hash, cached
+
+def finish_analysis(content, image_path, content_hash, debug_info, fallback=True, prompt_version=None, model=None):
+    """
+    Parses response text into the metadata dictionary and caches it when it
+    parsed as JSON. Unparseable responses fall back to a manual structure
+    (or None with fallback=False) and are not cached, so the next attempt
+    retries the API.
+
+    prompt_version and model are those the request was made with, and
+    default to the current ones; a batch submitted before the prompt changed
+    passes its own. The dictionary's prompt_version is that version when the
+    response parsed and None for the fallback, so saving it records whether
+    the analysis is current.
+    """
+    prompt_version = prompt_version or PROMPT_VERSION
+    model = model or MODEL
+    with metrics.span("parse"):
+        analysis_dict = _parse_json_content(content, debug_info)
+        if analysis_dict is None:
+            metrics.increment(metrics.PARSE_FALLBACKS)
+            return _fallback_analysis(content, image_path, debug_info) if fallback else None
+    analysis_dict["prompt_version"] = prompt_version
+    if content_hash is not None:
+        db_manager.save_cached_analysis(content_hash, prompt_version, model, analysis_dict)
+    return analysis_dict
+
+def analyze_image(image_path, debug_info=None, use_cache=True, request=None):
+    """
+    Analyzes an image using GPT-4o and returns the structured dictionary.
+    Results are cached by content hash, prompt version and model, so the same
+    bytes are never sent twice. Unlike analyze_image_with_gpt, errors are
+    raised rather than reported. request replaces request_analysis for the
+    API call, e.g. with a version that retries on rate limits.
+    """
+    if debug_info is None:
+        debug_info = []
+    content_hash = None
+    if use_cache:
+        content_hash, cached = lookup_cached_analysis(image_path, debug_info)
+        if cached is not None:
+            return cached
+
+    content = (request or request_analysis)(image_path, debug_info)
+    return finish_analysis(content, image_path, content_hash, debug_info)
+
 def analyze_image_with_gpt(image_path):
     """
     Analyzes an image using GPT-4o and returns a structured dictionary.
@@ -71,105 +435,14 @@ def analyze_image_with_gpt(image_path):
     """
     debug_info = []
     
-    if not client:
+    if not get_client():
         error_msg = f"OpenAI client not initialized. Init error: {init_error}"
         debug_info.append(error_msg)
         logger.error(error_msg)
         return None, debug_info
         
     try:
-        debug_info.append(f"🔍 Encoding image: {image_path}")
-        logger.info(f"Encoding image: {image_path}")
-        base64_image = encode_image(image_path)
-        debug_info.append(f"✅ Image encoded successfully, size: {len(base64_image)} characters")
-        logger.info(f"Image encoded successfully, size: {len(base64_image)} characters")
-        
-        debug_info.append("🚀 Making OpenAI API call...")
-        logger.info("Making OpenAI API call...")
-        
-        try:
-            # This is the modern and correct way to call the API
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": get_system_prompt()
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "Please analyze this image and provide the JSON output."},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}",
-                                    "detail": "high"
-                                }
-                            },
-                        ],
-                    }
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.7,
-                max_tokens=2000
-            )
-        except Exception as api_error:
-            debug_info.append(f"❌ API call failed: {api_error}")
-            raise api_error
-        
-        debug_info.append("✅ API call successful, parsing response...")
-        logger.info("API call successful, parsing response...")
-        content = response.choices[0].message.content
-        debug_info.append(f"📄 Raw response preview: {content[:200]}...")
-        logger.info(f"Raw response: {content[:200]}...")
-        
-        # Try to parse JSON from the response
-        try:
-            analysis_dict = json.loads(content)
-            debug_info.append("🎉 JSON parsed successfully")
-            logger.info("JSON parsed successfully")
-            return analysis_dict, debug_info
-        except json.JSONDecodeError:
-            # If it's not valid JSON, try to extract JSON from the text
-            import re
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                try:
-                    analysis_dict = json.loads(json_match.group())
-                    debug_info.append("🎉 JSON extracted and parsed successfully")
-                    logger.info("JSON extracted and parsed successfully")
-                    return analysis_dict, debug_info
-                except:
-                    pass
-            
-            # If we can't parse JSON, create a structured response manually
-            debug_info.append("⚠️ Could not parse JSON, creating manual structure")
-            analysis_dict = {
-                'image_id': f"IMG-{os.path.basename(image_path).split('.')[0]}",
-                'image_type': 'Real Photograph',
-                'style_name': 'AI Analysis Result',
-                'composition_structure': content[:200] + "...",
-                'color_palette': 'Unable to analyze',
-                'lighting': 'Unable to analyze',
-                'texture_finish': 'Unable to analyze',
-                'geometry_flow': 'Unable to analyze',
-                'primary_emotional_tone': 'Unable to analyze',
-                'emotional_keyword_tags': 'ai-generated, analysis',
-                'narrative_metaphor': content,
-                'ai_generation_prompt': 'N/A',
-                'recreation_guidelines': 'See narrative section for AI response',
-                'recommended_use_cases': 'General use'
-            }
-            return analysis_dict, debug_info
-        
-    except json.JSONDecodeError as e:
-        error_msg = f"❌ JSON parsing error: {e}"
-        debug_info.append(error_msg)
-        debug_info.append(f"Raw content: {content}")
-        logger.error(error_msg)
-        logger.error(f"Raw content: {content}")
-        return None, debug_info
+        return analyze_image(image_path, debug_info), debug_info
     except Exception as e:
         error_msg = f"❌ OpenAI API error: {type(e).__name__}: {e}"
         debug_info.append(error_msg)
@@ -178,4 +451,4 @@ def analyze_image_with_gpt(image_path):
         traceback_str = traceback.format_exc()
         debug_info.append(f"Full traceback: {traceback_str}")
         logger.error(f"Full traceback: {traceback_str}")
-        return None, debug_info 
\ No newline at end of file
+        return None, debug_info
@@ -0,0 +1,66 @@
+import openai
+import pytest
+from PIL import Image
+
+from benchmarks.mock_openai import MockOpenAIServer
+from src import batch_backfill, db_manager, metrics, vision_analyzer
+
+IMAGES = 3
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    """A catalog of stale records in tmp_path, analyzed against a mock OpenAI API."""
+    db_manager.close_connection()
+    monkeypatch.setattr(db_manager, "DB_PATH", str(tmp_path / "catalog.db"))
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path / "metrics"))
+    db_manager.create_table()
+    records = []
+    for number in range(IMAGES):
+        path = tmp_path / f"image-{number}.jpg"
+        Image.new("RGB", (64, 48), (number * 80, 40, 200)).save(path)
+        records.append({"image_id": f"IMG-{number}", "image_path": str(path), "prompt_version": "old"})
+    db_manager.insert_image_records(records)
+
+    with MockOpenAIServer(seed=0) as server:
+        monkeypatch.setattr(
+            vision_analyzer, "client", openai.OpenAI(api_key="test", base_url=server.base_url, max_retries=0)
+        )
+        yield server
+    # Before METRICS_DIR is restored, so the exit flush has nothing to write
+    metrics.flush_pending()
+    db_manager.close_connection()
+
+
+def _prompt_versions():
+    return {record["image_id"]: record["prompt_version"] for record in db_manager.get_image_records(
+        f"IMG-{number}" for number in range(IMAGES)
+    )}
+
+
+def test_submit_poll_apply(catalog, tmp_path):
+    stats = batch_backfill.submit_backfill(batch_dir=str(tmp_path / "batches"))
+    assert stats["requests"] == IMAGES and len(stats["batches"]) == 1
+    # Waiting in a batch, so not submitted again
+    assert db_manager.get_stale_images(vision_analyzer.PROMPT_VERSION) == []
+
+    running, applied = batch_backfill.poll_batches()
+    assert running == 0
+    assert applied[0][1]["applied"] == IMAGES
+    assert set(_prompt_versions().values()) == {vision_analyzer.PROMPT_VERSION}
+    assert db_manager.get_stale_images(vision_analyzer.PROMPT_VERSION) == []
+
+
+def test_prompt_change_while_batch_pending(catalog, tmp_path, monkeypatch):
+    """Results of a batch made with an older prompt leave records stale and aren't reused from the cache."""
+    batch_backfill.submit_backfill(batch_dir=str(tmp_path / "batches"))
+    submitted_version = vision_analyzer.PROMPT_VERSION
+    monkeypatch.setattr(vision_analyzer, "PROMPT_VERSION", "new-prompt")
+
+    batch_backfill.poll_batches()
+    assert set(_prompt_versions().values()) == {submitted_version}
+
+    stats = batch_backfill.submit_backfill(batch_dir=str(tmp_path / "batches"))
+    assert stats["cached"] == 0 and stats["requests"] == IMAGES
+    batch_backfill.poll_batches()
+    assert set(_prompt_versions().values()) == {"new-prompt"}
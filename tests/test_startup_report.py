@@ -0,0 +1,25 @@
+import statistics
+
+from src import startup_report
+
+# Generous enough for a cold CI runner; locally the total is about 150 ms
+BUDGET_MS = 400
+RUNS = 3
+
+
+def test_dashboard_imports_within_budget():
+    """The median import time of the dashboard's startup modules stays within budget."""
+    runs = [startup_report.measure_imports() for _ in range(RUNS)]
+    median = statistics.median(startup_report.total_ms(entries) for entries in runs)
+    assert median <= BUDGET_MS, f"{median:.1f} ms is over the {BUDGET_MS} ms budget"
+
+
+def test_heavy_packages_are_imported_lazily():
+    """openai and pandas are not loaded until first use."""
+    entries = startup_report.measure_imports()
+    assert startup_report.lazy_violations(entries) == []
+
+
+def test_lazy_violations_detects_eager_import():
+    entries = startup_report.measure_imports(("src.db_manager", "openai"))
+    assert startup_report.lazy_violations(entries) == ["openai"]
@@ -0,0 +1,28 @@
+import base64
+import mmap
+import os
+import tracemalloc
+
+from src import vision_analyzer
+
+SOURCE_BYTES = 30 * 1024 * 1024
+PREFIX = "data:image/jpeg;base64,"
+
+
+def test_build_data_url_peak_memory(tmp_path):
+    """A data URL for S mmapped bytes peaks at about 2 x 4/3 x S: the buffer plus the final string."""
+    path = tmp_path / "large.bin"
+    path.write_bytes(os.urandom(SOURCE_BYTES))
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        tracemalloc.start()
+        try:
+            data_url = vision_analyzer.build_data_url("image/jpeg", mapped)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert data_url == PREFIX + base64.b64encode(mapped).decode("ascii")
+
+    encoded_bytes = 4 * SOURCE_BYTES / 3
+    # One encoded chunk (1 MiB) on top of the two full-size copies is within the slack
+    assert 1.9 * encoded_bytes <= peak <= 2.1 * encoded_bytes